@@ -9,19 +9,258 @@ import os
 import io
 import subprocess
 import shutil
-from PIL import Image
-from flask import Flask, request, jsonify, send_file, render_template_string
+import threading
+import time
+import uuid
+import json
+import gzip
+import math
+import hashlib
+import importlib
+import multiprocessing
+import struct
+import tempfile
+import warnings
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+_import_started = time.perf_counter()
+
+from flask import (Flask, Request, Response, g, request, jsonify, send_from_directory,
+                   stream_with_context)
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 CORS(app)
 
 UPLOAD_FOLDER = 'uploads'
+RESUMABLE_FOLDER = os.path.join(UPLOAD_FOLDER, 'resumable')
 OUTPUT_FOLDER = 'outputs'
+CACHE_FOLDER = os.path.join(OUTPUT_FOLDER, 'cache')
+JOBS_FOLDER = os.path.join(OUTPUT_FOLDER, 'jobs')
+METRICS_FOLDER = os.path.join(OUTPUT_FOLDER, 'metrics')
+# Créés par init_storage au démarrage du serveur, pas à l'import (cli.py, bench.py)
+DATA_FOLDERS = (UPLOAD_FOLDER, RESUMABLE_FOLDER, OUTPUT_FOLDER, CACHE_FOLDER, JOBS_FOLDER, METRICS_FOLDER)
+
+# Serveur: 'dev' (serveur Flask de développement) ou 'gunicorn' (WEB_WORKERS processus
+# préforkés servant chacun WEB_THREADS requêtes), port d'écoute, durée du keep-alive HTTP,
+# délai laissé aux compressions en cours à l'arrêt et taille max d'une requête
+SERVER = os.environ.get('SERVER', 'dev')
+PORT = int(os.environ.get('PORT', 5000))
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 2)) if SERVER == 'gunicorn' else 1
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+KEEPALIVE = int(os.environ.get('KEEPALIVE', 5))
+GRACEFUL_TIMEOUT = int(os.environ.get('GRACEFUL_TIMEOUT', 600))
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 1024))
+DEBUG = os.environ.get('FLASK_DEBUG', '1' if SERVER == 'dev' else '0') == '1'
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+# File de jobs: nombre de workers de compression par processus serveur (0 = les cœurs
+# répartis entre les WEB_WORKERS), durée de rétention des jobs terminés et intervalle
+# max entre deux messages d'un flux d'événements (commentaire keep-alive si rien ne bouge).
+# Un flux long (événements, ZIP) occupe un thread: un flux d'événements se ferme après
+# EVENTS_MAX_SECONDS (le navigateur se reconnecte), et chaque processus serveur en garde
+# au plus MAX_STREAMS ouverts (0 = la moitié de WEB_THREADS)
+CPU_CORES = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 0)) or max(1, (os.cpu_count() or 1) // WEB_WORKERS)
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 3600))
+EVENTS_KEEPALIVE = int(os.environ.get('EVENTS_KEEPALIVE', 15))
+EVENTS_MAX_SECONDS = int(os.environ.get('EVENTS_MAX_SECONDS', 60))
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', 0)) or max(1, WEB_THREADS // 2)
+
+# Ordonnancement: images, GIF et vidéos passent chacun dans leur voie, avec ses propres
+# workers (MAX_WORKERS pour les images), pour qu'une file de vidéos ne retarde jamais
+# les images; dans une voie, les clients sont servis à tour de rôle. Le coût d'un
+# fichier se compte en mégapixels traités (pixels × images). Chaque client (adresse IP)
+# a un seau de ADMISSION_BURST Mpx rechargé à ADMISSION_RATE Mpx/s: à découvert, ou si
+# l'attente d'une voie dépasse LANE_MAX_BACKLOG Mpx, la requête reçoit HTTP 429.
+# Les workers GIF et vidéo (et leurs ffmpeg) tournent avec la priorité abaissée de
+# BACKGROUND_NICE: à cœurs saturés, le noyau sert d'abord les images.
+GIF_WORKERS = int(os.environ.get('GIF_WORKERS', 0)) or max(1, MAX_WORKERS // 2)
+VIDEO_WORKERS = int(os.environ.get('VIDEO_WORKERS', 0)) or max(1, MAX_WORKERS // 2)
+BACKGROUND_NICE = int(os.environ.get('BACKGROUND_NICE', 10))
+ADMISSION_RATE = float(os.environ.get('ADMISSION_RATE', 200))
+ADMISSION_BURST = float(os.environ.get('ADMISSION_BURST', 20000))
+LANE_MAX_BACKLOG = float(os.environ.get('LANE_MAX_BACKLOG', 200000))
+OVERLOAD_RETRY_AFTER = 30
+
+# Cache de résultats: taille max sur disque, partagée entre les WEB_WORKERS processus
+# (chacun n'indexe et n'évince que ses entrées); CACHE_VERSION invalide le cache
+# quand l'algorithme de compression change
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_MB', 1024)) * 1024 * 1024
+CACHE_PROCESS_BYTES = CACHE_MAX_BYTES // WEB_WORKERS
+CACHE_VERSION = 8
+CHUNK_SIZE = 1024 * 1024
+
+# Ingestion: 'memory' décode les images (et les vidéos WebM/MKV via stdin de ffmpeg)
+# depuis un tampon mémoire; au-delà de SPOOL_MAX_MB le fichier bascule sur disque, de
+# même quand les uploads tenus en mémoire par ce processus (reçus ou en attente d'un
+# worker) atteignent INGEST_MEMORY_MB. 'disk' enregistre systématiquement dans UPLOAD_FOLDER.
+INGEST_MODE = os.environ.get('INGEST_MODE', 'memory')
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_MB', 32)) * 1024 * 1024
+INGEST_MEMORY_BYTES = int(os.environ.get('INGEST_MEMORY_MB', 256)) * 1024 * 1024
+
+# Qualité cible (niveau 'target'): SSIM visé par défaut, bornes de la recherche,
+# nombre max d'encodages d'essai, taille de l'aperçu et taille du cache des qualités
+DEFAULT_TARGET_SSIM = float(os.environ.get('TARGET_SSIM', 0.95))
+TARGET_QUALITY_MIN = 30
+TARGET_QUALITY_MAX = 95
+TARGET_MAX_TRIALS = int(os.environ.get('TARGET_MAX_TRIALS', 6))
+TARGET_PREVIEW = 512
+QUALITY_CACHE_SIZE = 10000
+
+# Format automatique: encodeurs candidats (extension, format Pillow, sans perte),
+# taille de l'aperçu du premier tour et seuil d'élimination par rapport au meilleur
+IMAGE_ENCODERS = {
+    'webp': ('.webp', 'WebP', False),
+    'webp_lossless': ('.webp', 'WebP', True),
+    'jpeg': ('.jpg', 'JPEG', False),
+    'png': ('.png', 'PNG', True),
+    'avif': ('.avif', 'AVIF', False),
+}
+# Encodeurs sans canal alpha: écartés du mode 'auto' pour les images transparentes
+OPAQUE_ENCODERS = {'jpeg'}
+AUTO_PREVIEW = 256
+AUTO_CUTOFF = 1.5
+
+# GIF animés: threads de quantification par fichier (0 = les cœurs partagés entre tous
+# les workers GIF des WEB_WORKERS processus, 4 au plus), et palette commune à toutes les
+# frames (plus rapide, mais moins fidèle qu'une palette adaptative par frame)
+GIF_THREADS = int(os.environ.get('GIF_THREADS', 0)) or min(4, max(1, CPU_CORES // (GIF_WORKERS * WEB_WORKERS)))
+GIF_SHARED_PALETTE = os.environ.get('GIF_SHARED_PALETTE', '0') == '1'
+
+# Métadonnées des images (champ metadata): l'orientation EXIF est toujours appliquée aux
+# pixels. 'strip' convertit un profil ICC autre que sRGB en sRGB et n'écrit aucune
+# métadonnée (EXIF, XMP, miniatures, commentaires); 'keep' conserve l'EXIF (sans
+# miniature, orientation remise à 1) et le profil ICC d'origine. Le XMP n'est jamais recopié.
+METADATA_POLICY = os.environ.get('METADATA_POLICY', 'strip')
+METADATA_POLICIES = ('strip', 'keep')
+# Clés de Image.info comptées comme métadonnées dans metadata_saved
+METADATA_KEYS = ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp', 'comment')
+# Orientation EXIF -> transposition qui redresse l'image (table de ImageOps.exif_transpose)
+ORIENTATION_TRANSPOSE = {2: 'FLIP_LEFT_RIGHT', 3: 'ROTATE_180', 4: 'FLIP_TOP_BOTTOM',
+                         5: 'TRANSPOSE', 6: 'ROTATE_270', 7: 'TRANSVERSE', 8: 'ROTATE_90'}
+
+# Variantes responsive (variantSizes): threads d'encodage par image et nombre max de
+# tailles par requête
+VARIANT_THREADS = int(os.environ.get('VARIANT_THREADS', 0)) or min(4, os.cpu_count() or 1)
+MAX_VARIANT_SIZES = 8
+
+# Vidéo: threads ffmpeg par fichier (0 = les cœurs partagés entre tous les workers vidéo
+# des WEB_WORKERS processus), découpage en segments encodés en parallèle au-delà de
+# VIDEO_SEGMENT_MIN_DURATION secondes (VIDEO_SEGMENT_SECONDS=0 le désactive) et durée
+# max d'un appel ffmpeg
+VIDEO_THREADS = int(os.environ.get('VIDEO_THREADS', 0)) or max(1, CPU_CORES // (VIDEO_WORKERS * WEB_WORKERS))
+VIDEO_SEGMENT_SECONDS = int(os.environ.get('VIDEO_SEGMENT_SECONDS', 30))
+VIDEO_SEGMENT_MIN_DURATION = int(os.environ.get('VIDEO_SEGMENT_MIN_DURATION', 120))
+VIDEO_PARALLEL_SEGMENTS = int(os.environ.get('VIDEO_PARALLEL_SEGMENTS', 0)) or max(1, VIDEO_THREADS // 2)
+VIDEO_TIMEOUT = int(os.environ.get('VIDEO_TIMEOUT', 3600))
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# Stockage des sorties: chaque job écrit dans OUTPUT_FOLDER/<job_id>/. Un balayage toutes
+# les SWEEP_INTERVAL secondes supprime les jobs plus vieux que OUTPUT_TTL secondes, puis
+# les plus anciens tant que le total dépasse OUTPUT_QUOTA_MB, ainsi que les uploads
+# orphelins (arrêt brutal) après UPLOAD_TTL. Le cache a sa propre limite (CACHE_MAX_MB).
+OUTPUT_TTL = int(os.environ.get('OUTPUT_TTL', 24 * 3600))
+OUTPUT_QUOTA_BYTES = int(os.environ.get('OUTPUT_QUOTA_MB', 10240)) * 1024 * 1024
+UPLOAD_TTL = int(os.environ.get('UPLOAD_TTL', 2 * VIDEO_TIMEOUT))
+SWEEP_INTERVAL = int(os.environ.get('SWEEP_INTERVAL', 300))
+
+# Uploads reprenables (/uploads): taille max d'un fichier envoyé par morceaux et délai
+# d'inactivité après lequel un envoi abandonné est supprimé par le balayage
+RESUMABLE_MAX_BYTES = int(os.environ.get('RESUMABLE_MAX_MB', 8192)) * 1024 * 1024
+RESUMABLE_TTL = int(os.environ.get('RESUMABLE_TTL', 24 * 3600))
+
+# Grandes images: au-delà de MAX_IMAGE_PIXELS une image est refusée dès la lecture de
+# l'en-tête (bombe de décompression; 0 = pas de limite). Au-delà de LARGE_IMAGE_PIXELS,
+# une image non compressée (TIFF, BMP, PPM) à réduire est décodée et réduite par bandes
+# d'environ STRIP_BYTES; sinon le décodage complet est refusé s'il dépasse IMAGE_MEMORY_MB
+# (estimé à DECODE_BYTES_PER_PIXEL: image décodée plus une copie convertie).
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 200_000_000))
+LARGE_IMAGE_PIXELS = int(os.environ.get('LARGE_IMAGE_PIXELS', 40_000_000))
+IMAGE_MEMORY_MB = int(os.environ.get('IMAGE_MEMORY_MB', 2048))
+STRIP_BYTES = 32 * 1024 * 1024
+DECODE_BYTES_PER_PIXEL = 8
+# Bits par pixel des formats bruts lisibles par bandes
+RAW_BITS = {'L': 8, 'RGB': 24, 'BGR': 24, 'RGBA': 32, 'BGRA': 32, 'RGBX': 32, 'BGRX': 32}
+
+# Redimensionnement: niveau de rééchantillonnage -> (marge du décodage JPEG à l'échelle
+# DCT, reducing_gap). Avant le Lanczos final, l'image est réduite par blocs (reduce)
+# jusqu'à reducing_gap fois la cible: 'quality' décode tout et applique Lanczos à
+# l'image entière, 'fast' réduit par blocs au plus près de la cible. Par défaut le
+# niveau suit celui de compression (voir bench.py resize pour les écarts de SSIM).
+RESIZE_TIERS = {
+    'quality': (None, None),
+    'balanced': (1, 2.0),
+    'fast': (1, 1.0),
+}
+RESIZE_TIER_BY_LEVEL = {'lossless': 'quality', 'aggressive': 'fast'}
+
+# Interface web: durée de cache navigateur de la page (revalidée ensuite par ETag)
+UI_MAX_AGE = int(os.environ.get('UI_MAX_AGE', 86400))
+
+# Copie de flux: débit vidéo (bits par pixel et par image) en dessous duquel une
+# vidéo H.264 est remuxée sans réencodage, selon le niveau de compression
+STREAM_COPY_BPP = {'lossless': 0.15, 'balanced': 0.08, 'aggressive': 0.04}
+
+# Table de quantification luminance standard (JPEG, annexe K), pour estimer la
+# qualité d'un JPEG existant
+JPEG_LUMA_TABLE = [
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+]
+
+# --- Imports différés -------------------------------------------------------
+# Pillow et NumPy ne sont chargés qu'au premier usage: un processus qui ne sert que
+# l'interface, les téléchargements ou l'état des jobs démarre sans eux.
+
+_lazy_lock = threading.Lock()
+
+class LazyModule:
+    """Module importé au premier accès à un de ses attributs
+
+    Une fois chargé, le module remplace ce substitut dans les globales de app.py: les
+    accès suivants ne passent plus par ici.
+    """
+
+    def __init__(self, name, alias, on_load=None):
+        self.name = name
+        self.alias = alias
+        self.on_load = on_load
+
+    def __getattr__(self, attr):
+        with _lazy_lock:
+            module = globals()[self.alias]
+            if module is self:
+                module = importlib.import_module(self.name)
+                if self.on_load:
+                    self.on_load(module)
+                globals()[self.alias] = module
+        return getattr(module, attr)
+
+def _configure_pillow(image_module):
+    """Réglages de Pillow, appliqués à son chargement"""
+    try:
+        # Enregistre l'encodeur AVIF dans Pillow s'il est installé
+        importlib.import_module('pillow_avif')
+    except ImportError:
+        pass
+    image_module.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS or None
+    # Pillow ne fait qu'avertir entre MAX_IMAGE_PIXELS et le double: refuser dès le seuil
+    warnings.simplefilter('error', image_module.DecompressionBombWarning)
+
+Image = LazyModule('PIL.Image', 'Image', _configure_pillow)
+ImageChops = LazyModule('PIL.ImageChops', 'ImageChops')
+GifImagePlugin = LazyModule('PIL.GifImagePlugin', 'GifImagePlugin')
+ImageCms = LazyModule('PIL.ImageCms', 'ImageCms')
+np = LazyModule('numpy', 'np')
 
 HTML_INTERFACE = '''
 <!DOCTYPE html>
@@ -136,6 +375,7 @@ HTML_INTERFACE = '''
             border-left: 4px solid #4caf50;
         }
         .result-item.error { background: #ffebee; border-left-color: #f44336; }
+        .result-item.pending { background: #f5f5f5; border-left-color: #bdbdbd; }
         .savings { 
             background: #4caf50; 
             color: white; 
@@ -221,6 +461,7 @@ HTML_INTERFACE = '''
                     <option value="lossless">🟢 Sans perte (qualité max)</option>
                     <option value="balanced" selected>🟡 Équilibré (recommandé)</option>
                     <option value="aggressive">🔴 Forte (fichiers légers)</option>
+                    <option value="target">🎯 Qualité perçue cible (SSIM)</option>
                     <option value="custom">⚙️ Personnalisé</option>
                 </select>
             </div>
@@ -229,6 +470,29 @@ HTML_INTERFACE = '''
                 <input type="range" id="quality" min="1" max="100" value="85">
                 <div class="quality-display" id="qualityValue">85%</div>
             </div>
+            <div class="option-group">
+                <label>🧪 Format de sortie</label>
+                <select id="outputFormat">
+                    <option value="default" selected>Selon le fichier d'origine</option>
+                    <option value="auto">Automatique (le plus léger)</option>
+                </select>
+            </div>
+            <div class="option-group">
+                <label>🏷️ Métadonnées</label>
+                <select id="metadata">
+                    <option value="strip" selected>Supprimer (EXIF, XMP, miniatures ; couleurs en sRGB)</option>
+                    <option value="keep">Conserver EXIF et profil couleur</option>
+                </select>
+            </div>
+            <div class="option-group">
+                <label>🔍 Redimensionnement</label>
+                <select id="resizeTier">
+                    <option value="" selected>Selon le niveau de compression</option>
+                    <option value="quality">Qualité (Lanczos sur l'image entière)</option>
+                    <option value="balanced">Équilibré</option>
+                    <option value="fast">Rapide</option>
+                </select>
+            </div>
             <div class="option-group">
                 <label>📐 Dimensions max (optionnel)</label>
                 <select id="maxDimension">
@@ -239,6 +503,14 @@ HTML_INTERFACE = '''
                     <option value="600">600px (Mobile)</option>
                 </select>
             </div>
+            <div class="option-group">
+                <label>🖼️ Variantes responsive (images)</label>
+                <select id="variantSizes">
+                    <option value="">Aucune</option>
+                    <option value="600,800,1080,1920">600, 800, 1080 et 1920px</option>
+                    <option value="600,1080">600 et 1080px</option>
+                </select>
+            </div>
         </div>
         
         <button class="btn" id="processBtn" disabled>
@@ -263,7 +535,7 @@ HTML_INTERFACE = '''
         
         dropZone.addEventListener('click', () => fileInput.click());
         dropZone.addEventListener('dragover', (e) => { e.preventDefault(); dropZone.style.background = '#c8e6c9'; });
-        dropZone.addEventListener('dragleave', () => dropZone.style.background = '#e8f5e9'; });
+        dropZone.addEventListener('dragleave', () => { dropZone.style.background = '#e8f5e9'; });
         dropZone.addEventListener('drop', (e) => { 
             e.preventDefault(); 
             dropZone.style.background = '#e8f5e9'; 
@@ -327,14 +599,17 @@ HTML_INTERFACE = '''
             formData.append('compressionLevel', compressionLevel.value);
             formData.append('quality', qualitySlider.value);
             formData.append('maxDimension', document.getElementById('maxDimension').value);
+            formData.append('outputFormat', document.getElementById('outputFormat').value);
+            formData.append('metadata', document.getElementById('metadata').value);
+            formData.append('resizeTier', document.getElementById('resizeTier').value);
+            formData.append('variantSizes', document.getElementById('variantSizes').value);
             
             try {
                 const res = await fetch('/compress', { method: 'POST', body: formData });
                 const data = await res.json();
+                if (!data.success) throw new Error(data.error);
                 
-                if (data.success) {
-                    showResults(data.results, data.stats);
-                } else throw new Error(data.error);
+                await followJob(data.job_id, data.status_url, files);
             } catch (e) {
                 alert('❌ ' + e.message);
             }
@@ -343,182 +618,2369 @@ HTML_INTERFACE = '''
             processBtn.disabled = false;
         });
         
-        function showResults(r, stats) {
+        async function waitForJob(url) {
+            while (true) {
+                const res = await fetch(url);
+                const job = await res.json();
+                if (!job.success) throw new Error(job.error);
+                if (job.status === 'done') return job;
+                const percent = Math.round(job.progress.reduce((a, b) => a + b, 0) / job.total);
+                processBtn.innerHTML = `<span class="spinner"></span>Compression en cours... ${job.completed}/${job.total} (${percent}%)`;
+                await new Promise(r => setTimeout(r, 1000));
+            }
+        }
+        
+        // Chaque résultat s'affiche (et se télécharge) dès que son fichier est prêt;
+        // sans EventSource ou si le flux coupe, on retombe sur le polling de /jobs/<id>
+        function followJob(jobId, statusUrl, sent) {
+            showPending(sent, jobId);
+            const fallback = () => waitForJob(statusUrl).then(job => showResults(job.results, job.stats, jobId));
+            if (!window.EventSource) return fallback();
+            return new Promise((resolve, reject) => {
+                const source = new EventSource(`/jobs/${jobId}/events`);
+                source.addEventListener('progress', (e) => {
+                    const d = JSON.parse(e.data);
+                    const el = document.getElementById('progress-' + d.index);
+                    if (el) el.textContent = `Compression... ${d.percent}%`;
+                });
+                source.addEventListener('result', (e) => {
+                    const d = JSON.parse(e.data);
+                    const el = document.getElementById('result-' + d.index);
+                    if (el) el.outerHTML = renderResult(d.result, d.index);
+                    processBtn.innerHTML = `<span class="spinner"></span>Compression en cours... ${d.completed}/${d.total}`;
+                });
+                source.addEventListener('done', (e) => {
+                    source.close();
+                    showStats(JSON.parse(e.data).stats);
+                    resolve();
+                });
+                source.onerror = () => {
+                    if (source.readyState !== EventSource.CLOSED) return;  // reconnexion automatique
+                    fallback().then(resolve, reject);
+                };
+            });
+        }
+        
+        function archiveLink(jobId) {
+            return `<div class="result-item"><strong>📦 Tous les fichiers</strong><a href="/jobs/${jobId}/archive" class="download-btn" download>ZIP</a></div>`;
+        }
+        
+        function showPending(sent, jobId) {
+            document.getElementById('stats').style.display = 'none';
+            // Le ZIP est produit en flux: il peut se télécharger avant la fin du lot
+            results.innerHTML = (sent.length > 1 ? archiveLink(jobId) : '') + sent.map((f, i) => `
+                <div class="result-item pending" id="result-${i}">
+                    <div style="flex:1;">
+                        <strong>${f.name}</strong>
+                        <br>
+                        <small id="progress-${i}">En attente...</small>
+                    </div>
+                </div>
+            `).join('');
+        }
+        
+        function showStats(stats) {
             document.getElementById('stats').style.display = 'grid';
             document.getElementById('savedSize').textContent = stats.avgReduction + '%';
             document.getElementById('savedBytes').textContent = formatBytes(stats.totalSaved);
             document.getElementById('processedCount').textContent = stats.processed;
-            
-            results.innerHTML = r.map(x => {
-                if (x.error) return `<div class="result-item error"><div><strong>❌ ${x.original_name}</strong><br><small>${x.error}</small></div></div>`;
-                return `
-                    <div class="result-item">
-                        <div style="flex:1;">
-                            <strong>${x.original_name}</strong>
-                            <span class="format-badge">${x.output_format}</span>
-                            <br>
-                            <small>${formatBytes(x.original_size)} → ${formatBytes(x.compressed_size)}</small>
-                            <span class="savings">-${x.reduction}%</span>
-                        </div>
-                        <a href="${x.download_url}" class="download-btn" download>📥</a>
+        }
+        
+        function renderResult(x, i) {
+            if (x.error) return `<div class="result-item error" id="result-${i}"><div><strong>❌ ${x.original_name}</strong><br><small>${x.error}</small></div></div>`;
+            return `
+                <div class="result-item" id="result-${i}">
+                    <div style="flex:1;">
+                        <strong>${x.original_name}</strong>
+                        <span class="format-badge">${x.output_format}</span>
+                        <br>
+                        <small>${formatBytes(x.original_size)} → ${formatBytes(x.compressed_size)}</small>
+                        <span class="savings">-${x.reduction}%</span>
+                        ${x.metadata_saved ? `<small>dont ${formatBytes(x.metadata_saved)} de métadonnées</small>` : ''}
+                        ${x.variants ? '<br><small>' + x.variants.map(v => `<a href="${v.download_url}" download>${v.width}w ${v.format}</a>`).join(' · ') + '</small>' : ''}
                     </div>
-                `;
-            }).join('');
+                    <a href="${x.download_url}" class="download-btn" download>📥</a>
+                </div>
+            `;
+        }
+        
+        function showResults(r, stats, jobId) {
+            showStats(stats);
+            results.innerHTML = (stats.processed > 1 ? archiveLink(jobId) : '') + r.map(renderResult).join('');
         }
     </script>
 </body>
 </html>
 '''
 
-def get_compression_settings(level, quality=None):
-    """Retourne les paramètres de compression selon le niveau"""
+# --- Métriques ----------------------------------------------------------------
+# Compteurs et histogrammes au format texte Prometheus, exposés par /metrics.
+# Les workers chronomètrent chaque étape (stage) et renvoient les durées avec leur
+# résultat; le processus serveur les agrège. Avec plusieurs processus serveur, chacun
+# publie ses métriques dans METRICS_FOLDER et /metrics additionne le tout.
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+METRICS_INTERVAL = 5
+METRIC_HELP = {
+    'compressor_stage_seconds': ('histogram', "Durée de chaque étape du pipeline"),
+    'compressor_file_seconds': ('histogram', "Durée totale d'un fichier, attente dans la file comprise"),
+    'compressor_files_total': ('counter', "Fichiers traités, par issue (compressed, passthrough, cached, failed, rejected)"),
+    'compressor_bytes_in_total': ('counter', "Octets reçus"),
+    'compressor_bytes_out_total': ('counter', "Octets produits"),
+    'compressor_metadata_bytes_saved_total': ('counter', "Octets de métadonnées retirés des images"),
+    'compressor_queue_depth': ('gauge', "Fichiers soumis au pool et pas encore terminés"),
+    'compressor_admission_rejected_total': ('counter', "Requêtes refusées en HTTP 429, par motif (rate, overload)"),
+    'compressor_request_seconds': ('histogram', "Durée de traitement des requêtes HTTP, par route"),
+}
+KNOWN_LEVELS = ('lossless', 'balanced', 'aggressive', 'target')
+
+metrics_lock = threading.Lock()
+metrics = {'counters': {}, 'histograms': {}, 'gauges': {'compressor_queue_depth': 0}}
+_metrics_published = None
+_stage_timings = {}
+
+@contextmanager
+def stage(name):
+    """Chronomètre une étape du fichier en cours (cumulée dans _stage_timings)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_timings[name] = _stage_timings.get(name, 0) + time.perf_counter() - start
+
+def metric_labels(filename, compression_level):
+    """Labels media/level d'un fichier, bornés pour ne pas multiplier les séries"""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.gif':
+        media = 'gif'
+    elif ext in VIDEO_EXTENSIONS:
+        media = 'video'
+    elif ext in IMAGE_EXTENSIONS:
+        media = 'image'
+    else:
+        media = 'other'
+    return {'media': media, 'level': compression_level if compression_level in KNOWN_LEVELS else 'other'}
+
+def _series(name, labels):
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+def count(name, value=1, **labels):
+    """Incrémente un compteur"""
+    key = _series(name, labels)
+    with metrics_lock:
+        metrics['counters'][key] = metrics['counters'].get(key, 0) + value
+    _publish_metrics()
+
+def observe(name, value, **labels):
+    """Ajoute une mesure (secondes) à un histogramme"""
+    key = _series(name, labels)
+    with metrics_lock:
+        # [compte cumulé par borne..., somme, nombre]
+        series = metrics['histograms'].setdefault(key, [0] * (len(STAGE_BUCKETS) + 2))
+        for i, bound in enumerate(STAGE_BUCKETS):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+    _publish_metrics()
+
+def set_gauge(name, delta):
+    """Fait varier une jauge"""
+    with metrics_lock:
+        metrics['gauges'][name] = metrics['gauges'].get(name, 0) + delta
+    _publish_metrics()
+
+def _publish_metrics(force=False):
+    """Écrit les métriques de ce processus pour les autres processus serveur (au plus
+    toutes les METRICS_INTERVAL secondes)"""
+    global _metrics_published
+    if WEB_WORKERS < 2:
+        return
+    now = time.time()
+    with metrics_lock:
+        if not force and _metrics_published and now - _metrics_published < METRICS_INTERVAL:
+            return
+        _metrics_published = now
+        data = json.dumps(metrics)
+    path = os.path.join(METRICS_FOLDER, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+def process_alive(pid):
+    """Vrai si le processus pid (texte, nom d'un fichier de METRICS_FOLDER) existe encore"""
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # existe, mais appartient à un autre utilisateur
+    return True
+
+def collect_metrics():
+    """Métriques de ce processus, additionnées à celles publiées par les autres"""
+    with metrics_lock:
+        total = json.loads(json.dumps(metrics))
+    if WEB_WORKERS < 2:
+        return total
+    _publish_metrics(force=True)
+    for name in os.listdir(METRICS_FOLDER):
+        if name.endswith('.tmp') or name == f'{os.getpid()}.json':
+            continue
+        try:
+            with open(os.path.join(METRICS_FOLDER, name)) as f:
+                other = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # Processus arrêté (plantage, max_requests, timeout): ses compteurs restent
+        # acquis, mais ses jauges ne décrivent plus rien
+        kinds = ('counters', 'gauges') if process_alive(name[:-len('.json')]) else ('counters',)
+        for kind in kinds:
+            for key, value in other[kind].items():
+                total[kind][key] = total[kind].get(key, 0) + value
+        for key, series in other['histograms'].items():
+            mine = total['histograms'].setdefault(key, [0] * len(series))
+            total['histograms'][key] = [a + b for a, b in zip(mine, series)]
+    return total
+
+def render_metrics(data):
+    """Format texte d'exposition Prometheus"""
+    lines = []
+    for name, (kind, help_text) in METRIC_HELP.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'histogram':
+            for key, series in sorted(data['histograms'].items()):
+                if not key.startswith(name + '{'):
+                    continue
+                labels = key[len(name) + 1:-1]
+                for bound, value in zip(STAGE_BUCKETS, series):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {value}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+                lines.append(f'{name}_sum{{{labels}}} {round(series[-2], 6)}')
+                lines.append(f'{name}_count{{{labels}}} {series[-1]}')
+        else:
+            values = data['counters'] if kind == 'counter' else data['gauges']
+            for key, value in sorted(values.items()):
+                if key == name or key.startswith(name + '{'):
+                    lines.append(f'{key} {value}')
+    return '\n'.join(lines) + '\n'
+
+def get_compression_settings(level, quality=None, target_ssim=None):
+    """Retourne les paramètres de compression selon le niveau
+
+    'target': la qualité est cherchée image par image pour atteindre un score SSIM
+    cible (voir search_quality); 'quality' sert alors de valeur de repli.
+    """
     settings = {
-        'lossless': {'quality': 95, 'method': 6, 'optimize': True},
+        'lossless': {'quality': 95, 'method': 6, 'optimize': True, 'lossless': True},
         'balanced': {'quality': 85, 'method': 6, 'optimize': True},
         'aggressive': {'quality': 70, 'method': 4, 'optimize': True},
-        'custom': {'quality': int(quality) if quality else 85, 'method': 6, 'optimize': True}
+        'custom': {'quality': int(quality) if quality else 85, 'method': 6, 'optimize': True},
+        'target': {'quality': 85, 'method': 6, 'optimize': True,
+                   'target_ssim': float(target_ssim) if target_ssim else DEFAULT_TARGET_SSIM}
+    }
+    return dict(settings.get(level, settings['balanced']), resize=RESIZE_TIER_BY_LEVEL.get(level, 'balanced'))
+
+def ssim(a, b, window=7):
+    """SSIM moyen entre deux images en niveaux de gris (tableaux NumPy)
+
+    Moyennes locales sur une fenêtre carrée, calculées par sommes cumulées.
+    """
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    
+    def local_mean(x):
+        s = np.pad(x.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        return (s[window:, window:] - s[:-window, window:]
+                - s[window:, :-window] + s[:-window, :-window]) / (window * window)
+    
+    mu_a = local_mean(a)
+    mu_b = local_mean(b)
+    var_a = local_mean(a * a) - mu_a ** 2
+    var_b = local_mean(b * b) - mu_b ** 2
+    cov = local_mean(a * b) - mu_a * mu_b
+    score = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(score.mean())
+
+def search_quality(img, settings, name='webp'):
+    """Cherche la qualité la plus basse de l'encodeur `name` qui atteint settings['target_ssim']
+
+    Recherche dichotomique sur un aperçu réduit (TARGET_PREVIEW px), limitée à
+    TARGET_MAX_TRIALS encodages. Retourne (qualité, SSIM obtenu).
+    """
+    preview = img.convert('RGB')
+    preview.thumbnail((TARGET_PREVIEW, TARGET_PREVIEW))
+    reference = np.asarray(preview.convert('L'))
+    if min(reference.shape) < 8:
+        return settings['quality'], None
+    
+    low, high = TARGET_QUALITY_MIN, TARGET_QUALITY_MAX
+    best, best_score = high, None
+    for _ in range(TARGET_MAX_TRIALS):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        data = encode_image(preview, name, dict(settings, quality=quality))
+        with Image.open(io.BytesIO(data)) as trial:
+            score = ssim(reference, np.asarray(trial.convert('L')))
+        if score >= settings['target_ssim']:
+            best, best_score = quality, score
+            high = quality - 1
+        else:
+            low = quality + 1
+    return best, best_score
+
+def search_qualities(img, settings, names):
+    """Qualité cible de chaque encodeur avec perte de names, cherchée en parallèle
+
+    Retourne {nom: (qualité, SSIM)}; les encodeurs sans perte n'ont pas de qualité.
+    """
+    lossy = [name for name in names if not IMAGE_ENCODERS[name][2]]
+    if not lossy:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(lossy)) as pool:
+        return dict(zip(lossy, pool.map(lambda name: search_quality(img, settings, name), lossy)))
+
+def search_info(qualities, name):
+    """Champs quality / ssim du résultat pour l'encodeur retenu"""
+    if name not in qualities:
+        return {}
+    quality, score = qualities[name]
+    return {'quality': quality, 'ssim': round(score, 4) if score else None}
+
+def fit_size(size, max_dim):
+    """Taille cible pour que le plus grand côté tienne dans max_dim (None si déjà le cas)"""
+    width, height = size
+    if max(size) <= max_dim:
+        return None
+    ratio = max_dim / max(size)
+    return (max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+def reduce_factor(size, new_size):
+    """Facteur de réduction entière (reduce) avant Lanczos, en gardant au moins 2x de marge"""
+    return min(size[0] // new_size[0], size[1] // new_size[1]) // 2
+
+def resize_to(img, new_size, tier='balanced'):
+    """Redimensionne en Lanczos après une réduction par blocs selon le niveau (RESIZE_TIERS)
+
+    La réduction par moyenne de blocs est bien moins coûteuse que Lanczos sur l'image
+    complète; avec 2x de marge ('balanced') le rééchantillonnage final conserve
+    l'essentiel de sa qualité.
+    """
+    return img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=RESIZE_TIERS[tier][1])
+
+def raw_strips(img):
+    """Tuiles d'une image non compressée lisibles par bandes, ou None
+
+    Retourne une liste (haut, bas, offset, rawmode, stride, orientation) à partir des
+    tuiles 'raw' déclarées par Pillow (TIFF non compressé, BMP, PPM...).
+    """
+    if img.mode not in ('L', 'RGB', 'RGBA'):
+        return None
+    tiles = []
+    for decoder, extents, offset, args in img.tile:
+        if decoder != 'raw':
+            return None
+        args = (args,) if isinstance(args, str) else tuple(args)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        if rawmode not in RAW_BITS or (extents[0], extents[2]) != (0, img.width):
+            return None
+        stride = stride or (img.width * RAW_BITS[rawmode] + 7) // 8
+        tiles.append((extents[1], extents[3], offset, rawmode, stride, orientation))
+    return tiles
+
+def read_raw_rows(img, tiles, top, bottom):
+    """Décode les lignes [top, bottom) d'une image non compressée sans lire le reste"""
+    band = None
+    for y0, y1, offset, rawmode, stride, orientation in tiles:
+        first, last = max(top, y0), min(bottom, y1)
+        if first >= last:
+            continue
+        # Lignes stockées de bas en haut (BMP, orientation -1): la bande est lue depuis la fin
+        row = first - y0 if orientation > 0 else y1 - last
+        img.fp.seek(offset + row * stride)
+        data = img.fp.read((last - first) * stride)
+        rows = Image.frombuffer(img.mode, (img.width, last - first), data, 'raw', rawmode, stride, orientation)
+        del data
+        if (first, last) == (top, bottom):
+            return rows  # une seule tuile couvre la bande: pas de copie
+        if band is None:
+            band = Image.new(img.mode, (img.width, bottom - top))
+        band.paste(rows, (0, first - top))
+    return band
+
+def reduce_in_strips(img, tiles, factor):
+    """Équivalent de img.reduce(factor) qui décode l'image par bandes de STRIP_BYTES
+
+    La hauteur des bandes est un multiple de factor: chaque bloc moyenné reste dans une
+    seule bande et le résultat est identique, sans jamais décoder l'image entière.
+    """
+    rows = max(factor, STRIP_BYTES // (img.width * 4) // factor * factor)
+    out = Image.new(img.mode, (-(-img.width // factor), -(-img.height // factor)))
+    for top in range(0, img.height, rows):
+        band = read_raw_rows(img, tiles, top, min(img.height, top + rows))
+        out.paste(band.reduce(factor), (0, top // factor))
+        del band  # libérer la bande avant de décoder la suivante
+    return out
+
+def check_decode_memory(img):
+    """Refuse une image dont le décodage complet dépasserait IMAGE_MEMORY_MB"""
+    needed = img.width * img.height * DECODE_BYTES_PER_PIXEL
+    if needed > IMAGE_MEMORY_MB * 1024 * 1024:
+        raise ValueError(f"Image trop volumineuse: {img.width}x{img.height} demanderait environ "
+                         f"{needed // (1024 * 1024)} Mo (max {IMAGE_MEMORY_MB} Mo)")
+
+def normalize_mode(img):
+    """Convertit en RGB, ou en RGBA si l'image a une transparence réelle
+
+    Un canal alpha entièrement opaque est abandonné (vérifié par getextrema, un seul
+    passage en C sur le canal), ce qui évite de coder un alpha inutile.
+    """
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        if img.getchannel('A').getextrema()[0] < 255:
+            return img
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+def flatten_alpha(img, color=(255, 255, 255)):
+    """Compose une image RGBA sur un fond uni (formats sans transparence)"""
+    background = Image.new('RGB', img.size, color)
+    background.paste(img, mask=img.getchannel('A'))
+    return background
+
+def read_metadata(img):
+    """Métadonnées d'une image ouverte, lues dans l'en-tête avant le décodage
+
+    Retourne {'orientation', 'exif' (Image.Exif), 'icc' (octets ou None), 'bytes'
+    (volume des métadonnées embarquées)}.
+    """
+    exif = img.getexif()
+    return {
+        'orientation': exif.get(0x0112, 1),
+        'exif': exif,
+        'icc': img.info.get('icc_profile') or None,
+        'bytes': sum(len(img.info[key]) for key in METADATA_KEYS if isinstance(img.info.get(key), (bytes, str)))
     }
-    return settings.get(level, settings['balanced'])
 
-def smart_compress_image(input_path, output_path, settings, max_dimension=None):
-    """Compresse intelligemment une image"""
+def drop_metadata(img):
+    """Retire les métadonnées de img.info: certains encodeurs Pillow les recopient d'office"""
+    for key in METADATA_KEYS:
+        img.info.pop(key, None)
+    return img
+
+def is_srgb(icc):
+    """Vrai si le profil ICC est un profil sRGB (ou illisible: il est alors ignoré)"""
+    try:
+        return 'srgb' in ImageCms.getProfileDescription(ImageCms.ImageCmsProfile(io.BytesIO(icc))).lower()
+    except (ImageCms.PyCMSError, OSError):
+        return True
+
+def convert_to_srgb(img, meta):
+    """Convertit les pixels d'un profil ICC large gamut (Display P3, Adobe RGB...) vers sRGB
+
+    Retourne (image, profil à embarquer): None si l'image est désormais en sRGB, le
+    profil d'origine si la conversion est impossible (couleurs préservées).
+    """
+    if not meta['icc'] or is_srgb(meta['icc']):
+        return img, None
+    if img.mode == 'P':
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    mode = 'RGBA' if img.mode in ('RGBA', 'LA', 'PA') else 'RGB'
+    try:
+        source = ImageCms.ImageCmsProfile(io.BytesIO(meta['icc']))
+        return ImageCms.profileToProfile(img, source, ImageCms.createProfile('sRGB'), outputMode=mode), None
+    except (ImageCms.PyCMSError, OSError, ValueError):
+        return img, meta['icc']
+
+def apply_orientation(img, meta):
+    """Applique l'orientation EXIF aux pixels (comme ImageOps.exif_transpose)"""
+    method = ORIENTATION_TRANSPOSE.get(meta['orientation'])
+    return img.transpose(getattr(Image.Transpose, method)) if method else img
+
+def output_metadata(meta, policy, icc):
+    """Options de sauvegarde Pillow (exif, icc_profile) selon la politique de métadonnées
+
+    icc: profil encore nécessaire après convert_to_srgb (politique 'strip').
+    """
+    if policy != 'keep':
+        return {'icc_profile': icc} if icc else {}
+    options = {}
+    if meta['exif']:
+        exif = meta['exif']
+        if 0x0112 in exif:
+            exif[0x0112] = 1  # orientation déjà appliquée aux pixels
+        # IFD1 (miniature) n'est pas réécrit par Exif.tobytes()
+        options['exif'] = exif.tobytes()
+    if meta['icc']:
+        options['icc_profile'] = meta['icc']
+    return options
+
+def metadata_saved(meta, options):
+    """Octets de métadonnées de l'original absents de la sortie"""
+    kept = sum(len(options[key]) for key in ('exif', 'icc_profile') if key in options)
+    return max(0, meta['bytes'] - kept)
+
+def strip_jpeg_metadata(data):
+    """Retire d'un JPEG, sans le réencoder, ses métadonnées
+
+    Segments APP1 à APP13 (EXIF et sa miniature, XMP, ICC, MPF, IPTC) et APP15,
+    commentaires, et images ajoutées après la fin du JPEG principal (aperçus MPF,
+    cartes de profondeur). APP0 (JFIF) et APP14 (Adobe, transformée couleur) sont gardés.
+    """
+    if not data.startswith(b'\xff\xd8'):
+        return data
+    parts = [data[:2]]
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xFF:  # octet de remplissage
+            pos += 1
+            continue
+        if marker == 0xDA:  # début des données compressées
+            break
+        end = pos + 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if not (0xE1 <= marker <= 0xED or marker in (0xEF, 0xFE)):
+            parts.append(data[pos:end])
+        pos = end
+    # Après SOS, 0xFF n'est suivi d'un marqueur D9 qu'à la fin de l'image
+    eoi = data.find(b'\xff\xd9', pos)
+    parts.append(data[pos:eoi + 2] if eoi != -1 else data[pos:])
+    return b''.join(parts)
+
+def estimate_jpeg_quality(img):
+    """Estime la qualité IJG (1-100) d'un JPEG d'après sa table de quantification luminance
+
+    Les encodeurs courants mettent à l'échelle la table standard de l'annexe K:
+    le rapport des sommes donne le facteur d'échelle, donc la qualité.
+    """
+    tables = getattr(img, 'quantization', None)
+    if not tables or 0 not in tables:
+        return None
+    scale = 100 * sum(tables[0]) / sum(JPEG_LUMA_TABLE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return max(1, min(100, round(quality)))
+
+def can_pass_through(fp, output_ext, settings, max_dimension=None):
+    """Pré-analyse d'en-tête: réencoder cette image peut-il la rendre plus légère?
+
+    Seul l'en-tête est lu (pas de décodage). Un JPEG qui reste en JPEG, sans
+    redimensionnement, et dont la qualité estimée est déjà inférieure ou égale à la
+    qualité demandée ne gagnerait rien à être réencodé. Avec la politique 'strip', ses
+    métadonnées doivent aussi pouvoir être retirées sans réencodage (pas de rotation
+    EXIF à appliquer ni de profil large gamut à convertir).
+    """
+    with Image.open(fp) as img:
+        if max_dimension and max(img.size) > int(max_dimension):
+            return False
+        if settings.get('metadata', METADATA_POLICY) == 'strip':
+            meta = read_metadata(img)
+            if meta['orientation'] != 1 or (meta['icc'] and not is_srgb(meta['icc'])):
+                return False
+        if img.format == 'JPEG' and ENCODER_BY_EXTENSION.get(output_ext) == 'jpeg':
+            quality = estimate_jpeg_quality(img)
+            return quality is not None and quality <= settings['quality']
+    return False
+
+def available_encoders(lossless_only=False, alpha=False):
+    """Encodeurs candidats du mode 'auto' pris en charge par ce Pillow"""
+    Image.init()
+    return [name for name, (_, fmt, lossless) in IMAGE_ENCODERS.items()
+            if fmt.upper() in Image.SAVE and (lossless or not lossless_only)
+            and (name not in OPAQUE_ENCODERS or not alpha)]
+
+def encode_image(img, name, settings, metadata=None):
+    """Encode une image avec l'encodeur `name` (voir IMAGE_ENCODERS) et retourne les octets
+
+    metadata: options exif / icc_profile à écrire (voir output_metadata)
+    """
+    _, fmt, _ = IMAGE_ENCODERS[name]
+    if name == 'webp':
+        options = {'quality': settings['quality'], 'method': settings['method']}
+    elif name == 'webp_lossless':
+        options = {'lossless': True, 'quality': 80, 'method': settings['method']}
+    elif name == 'jpeg':
+        options = {'quality': settings['quality'], 'optimize': settings['optimize'], 'progressive': True}
+        if img.mode == 'RGBA':
+            img = flatten_alpha(img)
+    elif name == 'png':
+        options = {'optimize': settings['optimize']}
+    else:
+        options = {'quality': settings['quality']}
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **options, **(metadata or {}))
+    return buffer.getvalue()
+
+def race_encoders(img, settings, lossless_only=False, metadata=None, qualities=None):
+    """Encode l'image avec tous les encodeurs candidats en parallèle et garde le plus petit
+
+    Un premier tour sur un aperçu réduit écarte les encodeurs nettement perdants
+    (plus de AUTO_CUTOFF fois le meilleur) avant l'encodage pleine résolution.
+    Pillow relâche le GIL pendant l'encodage: les threads s'exécutent en parallèle.
+    qualities: qualité propre à chaque encodeur (voir search_qualities).
+    Retourne (nom de l'encodeur, octets).
+    """
+    names = available_encoders(lossless_only, alpha=img.mode == 'RGBA')
+    qualities = qualities or {}
+    options = {name: dict(settings, quality=qualities[name][0]) if name in qualities else settings
+               for name in names}
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        preview = img.copy()
+        preview.thumbnail((AUTO_PREVIEW, AUTO_PREVIEW))
+        if preview.size != img.size and len(names) > 1:
+            sizes = dict(zip(names, pool.map(lambda name: len(encode_image(preview, name, options[name])),
+                                             names)))
+            best = min(sizes.values())
+            names = [name for name in names if sizes[name] <= best * AUTO_CUTOFF]
+        
+        futures = {name: pool.submit(encode_image, img, name, options[name], metadata) for name in names}
+        encoded = {name: future.result() for name, future in futures.items()}
+    winner = min(encoded, key=lambda name: len(encoded[name]))
+    return winner, encoded[winner]
+
+def decode_image(img, target_size=None, tier='balanced'):
+    """Décode une image ouverte, au plus près de target_size et à mémoire bornée"""
+    # JPEG: décoder directement à une échelle DCT (1/2, 1/4, 1/8) proche de la cible
+    margin = RESIZE_TIERS[tier][0]
+    if target_size and img.format == 'JPEG' and margin:
+        img.draft(img.mode, (target_size[0] * margin, target_size[1] * margin))
+    
+    # Grande image non compressée: décodage et réduction entière par bandes
+    tiles = raw_strips(img) if target_size and img.width * img.height > LARGE_IMAGE_PIXELS else None
+    if tiles and reduce_factor(img.size, target_size) >= 2:
+        return reduce_in_strips(img, tiles, reduce_factor(img.size, target_size))
+    check_decode_memory(img)
+    img.load()
+    return img
+
+def smart_compress_image(input_path, output_path, settings, max_dimension=None, auto_format=False):
+    """Compresse intelligemment une image (input_path: chemin ou objet fichier)
+
+    Le format de sortie suit l'extension de output_path. Avec auto_format, les
+    encodeurs candidats sont mis en concurrence et l'extension du plus petit est
+    ajoutée à output_path (renvoyée dans info['output_ext']). Les métadonnées suivent
+    settings['metadata'] (METADATA_POLICY par défaut).
+    """
+    policy = settings.get('metadata', METADATA_POLICY)
     with Image.open(input_path) as img:
-        # Convertir en RGB si nécessaire
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            if img.mode in ('RGBA', 'LA'):
-                background.paste(img, mask=img.split()[-1])
-                img = background
+        with stage('decode'):
+            meta = read_metadata(img)
+            target_size = fit_size(img.size, int(max_dimension)) if max_dimension else None
+            img = drop_metadata(decode_image(img, target_size, settings.get('resize', 'balanced')))
+        
+        # Profil large gamut vers sRGB, puis RGB, ou RGBA si l'image a une transparence réelle
+        with stage('convert'):
+            icc = meta['icc']
+            if policy == 'strip':
+                img, icc = convert_to_srgb(img, meta)
+            img = normalize_mode(img)
+            metadata = output_metadata(meta, policy, icc)
+        
+        # Redimensionner si nécessaire, puis redresser (rotation sur l'image réduite)
+        if target_size or meta['orientation'] != 1:
+            with stage('resize'):
+                if target_size:
+                    img = resize_to(img, target_size, settings.get('resize', 'balanced'))
+                img = apply_orientation(img, meta)
+        
+        with stage('encode'):
+            # Qualité cible: chercher, avec chaque encodeur visé, la qualité minimale
+            # qui atteint le score SSIM
+            lossless = settings.get('lossless', False)
+            name = None if auto_format else ENCODER_BY_EXTENSION[os.path.splitext(output_path)[1].lower()]
+            info, qualities = {}, {}
+            if settings.get('target_ssim'):
+                if settings.get('searched'):
+                    info = {'quality': settings['quality']}
+                else:
+                    names = [name] if name else available_encoders(lossless, alpha=img.mode == 'RGBA')
+                    qualities = search_qualities(img, settings, names)
+            
+            # Choisir le meilleur format
+            if auto_format:
+                name, data = race_encoders(img, settings, lossless, metadata, qualities)
+                output_ext = IMAGE_ENCODERS[name][0]
+                output_path += output_ext
+                info.update(output_ext=output_ext, encoder=name)
             else:
-                img = img.convert('RGB')
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
+                if name in qualities:
+                    settings = dict(settings, quality=qualities[name][0])
+                data = encode_image(img, name, settings, metadata)
+            info.update(search_info(qualities, name))
+            with open(output_path, 'wb') as out:
+                out.write(data)
+        info['metadata_saved'] = metadata_saved(meta, metadata)
+        return info
+
+def compress_variants(input_path, filename, output_ext, settings, output_dir=OUTPUT_FOLDER):
+    """Produit toutes les variantes (tailles x formats) d'une image en un seul décodage
+
+    Les tailles sont calculées en cascade, de la plus grande à la plus petite, chacune
+    réduite depuis la précédente; les encodages tournent en parallèle. Retourne
+    (chemin, extension, info) de la variante principale (la plus grande, premier
+    format), info contenant la liste des variantes et un srcset par format.
+    """
+    names = settings['variants']['formats'] or [ENCODER_BY_EXTENSION[output_ext] if output_ext else 'webp']
+    base = filename.rsplit('.', 1)[0]
+    policy = settings.get('metadata', METADATA_POLICY)
+    with Image.open(input_path) as img:
+        meta = read_metadata(img)
+        targets = []
+        for size in settings['variants']['sizes']:  # tailles décroissantes
+            dims = fit_size(img.size, size) or img.size
+            if dims not in targets:
+                targets.append(dims)
+        with stage('decode'):
+            img = drop_metadata(decode_image(img, targets[0] if targets[0] != img.size else None,
+                                             settings.get('resize', 'balanced')))
+        with stage('convert'):
+            icc = meta['icc']
+            if policy == 'strip':
+                img, icc = convert_to_srgb(img, meta)
+            img = normalize_mode(img)
+            metadata = output_metadata(meta, policy, icc)
         
-        # Redimensionner si nécessaire
-        if max_dimension:
-            max_dim = int(max_dimension)
-            if max(img.size) > max_dim:
-                ratio = max_dim / max(img.size)
-                new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+        # Cascade dans l'orientation d'origine; chaque variante est redressée ensuite
+        renditions = []
+        with stage('resize'):
+            for dims in targets:
+                if img.size != dims:
+                    img = resize_to(img, dims, settings.get('resize', 'balanced'))
+                renditions.append(img)
+            renditions = [apply_orientation(image, meta) for image in renditions]
         
-        # Choisir le meilleur format
-        ext = os.path.splitext(input_path)[1].lower()
+        info, options = {}, {name: settings for name in names}
+        if settings.get('target_ssim'):
+            if settings.get('searched'):
+                info = {'quality': settings['quality']}
+            else:
+                # Qualité cherchée une fois par format, sur la plus grande variante
+                with stage('encode'):
+                    qualities = search_qualities(renditions[0], settings, names)
+                options = {name: dict(settings, quality=qualities[name][0]) if name in qualities else settings
+                           for name in names}
+                info = search_info(qualities, names[0])
         
-        # Pour les photos: WebP
-        # Pour les images avec transparence: PNG
-        # Pour les logos/simples: PNG ou WebP
+        work = [(image, name) for image in renditions for name in names]
+        with stage('encode'), ThreadPoolExecutor(max_workers=min(VARIANT_THREADS, len(work))) as pool:
+            encoded = list(pool.map(lambda item: encode_image(item[0], item[1], options[item[1]], metadata),
+                                    work))
+    
+    extensions = [IMAGE_ENCODERS[name][0] for name in names]
+    variants = []
+    for (image, name), data in zip(work, encoded):
+        ext = IMAGE_ENCODERS[name][0]
+        # Deux encodeurs de même extension (webp / webp_lossless): le nom les distingue
+        tag = '' if extensions.count(ext) == 1 else f'_{name}'
+        path = os.path.join(output_dir, f'{base}_{image.width}w{tag}{ext}')
+        with open(path, 'wb') as out:
+            out.write(data)
+        variants.append({
+            'width': image.width,
+            'height': image.height,
+            'format': name,
+            'size': len(data),
+            'download_url': download_url(path)
+        })
+    info['metadata_saved'] = metadata_saved(meta, metadata)
+    info['variants'] = variants
+    info['srcset'] = {
+        name: ', '.join(f"{v['download_url']} {v['width']}w" for v in variants if v['format'] == name)
+        for name in names
+    }
+    main = variants[0]
+    return output_file(main['download_url']), IMAGE_ENCODERS[main['format']][0], info
+
+def video_params(compression_level):
+    """Retourne (crf, preset) x264 selon le niveau de compression"""
+    if compression_level == 'lossless':
+        return '18', 'slow'
+    elif compression_level == 'aggressive':
+        return '28', 'fast'
+    return '23', 'medium'
+
+def probe_video(source):
+    """Métadonnées ffprobe (format et flux) d'une vidéo (chemin, ou bytes sur stdin)"""
+    piped = isinstance(source, bytes)
+    cmd = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams',
+           'pipe:0' if piped else source]
+    out = subprocess.run(cmd, check=True, capture_output=True, timeout=60,
+                         input=source if piped else None).stdout
+    return json.loads(out)
+
+def media_duration(probe):
+    """Durée en secondes d'après ffprobe, ou None si inconnue"""
+    try:
+        return float(probe['format']['duration'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def stream_copy_possible(probe, compression_level, max_dimension=None):
+    """Pré-analyse ffprobe: la vidéo est-elle déjà en H.264 à un débit que le CRF visé ne battrait pas?
+
+    Le débit est ramené en bits par pixel et par image et comparé à STREAM_COPY_BPP;
+    l'audio doit pouvoir être copié tel quel dans un MP4.
+    """
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if not video or video.get('codec_name') != 'h264':
+        return False
+    if any(s.get('codec_type') == 'audio' and s.get('codec_name') not in ('aac', 'mp3') for s in streams):
+        return False
+    width, height = video.get('width'), video.get('height')
+    if not width or not height or (max_dimension and max(width, height) > int(max_dimension)):
+        return False
+    try:
+        bitrate = float(video.get('bit_rate') or probe['format']['bit_rate'])
+        num, _, den = (video.get('avg_frame_rate') or video.get('r_frame_rate') or '').partition('/')
+        fps = float(num) / float(den or 1)
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return False
+    if fps <= 0:
+        return False
+    threshold = STREAM_COPY_BPP.get(compression_level, STREAM_COPY_BPP['balanced'])
+    return bitrate / (width * height * fps) <= threshold
+
+def run_ffmpeg(args, progress=None, stdin_data=None, timeout=None):
+    """Exécute ffmpeg en suivant sa progression (-progress pipe:1)
+
+    stderr part dans un fichier temporaire plutôt qu'en mémoire; seule sa dernière
+    ligne est remontée en cas d'échec. progress(secondes encodées) est appelé à chaque
+    bloc de progression, et le processus est tué au-delà de `timeout` secondes.
+    """
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error', '-progress', 'pipe:1'] + args
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr,
+                                stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL)
+        timed_out = threading.Event()
         
-        if img.mode == 'RGBA':
-            # Garder PNG pour la transparence mais optimisé
-            img.save(output_path, 'PNG', optimize=True)
-        else:
-            # WebP pour meilleure compression
-            img.save(output_path, 'WebP', 
-                    quality=settings['quality'],
-                    method=settings['method'],
-                    optimize=settings['optimize'])
-
-def compress_video(input_path, output_path, compression_level, max_dimension=None):
-    """Compresse une vidéo avec ffmpeg"""
+        def kill():
+            timed_out.set()
+            proc.kill()
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer:
+            timer.start()
+        if stdin_data is not None:
+            def feed():
+                try:
+                    proc.stdin.write(stdin_data)
+                    proc.stdin.close()
+                except (BrokenPipeError, OSError):
+                    pass  # ffmpeg s'est arrêté avant la fin: son code de retour le dira
+            threading.Thread(target=feed, daemon=True).start()
+        try:
+            for line in proc.stdout:
+                key, _, value = line.decode(errors='replace').strip().partition('=')
+                # out_time_ms est aussi en microsecondes (nom historique de ffmpeg)
+                if progress and key in ('out_time_us', 'out_time_ms') and value.isdigit():
+                    progress(int(value) / 1_000_000)
+            proc.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            if proc.poll() is None:
+                proc.kill()
+        if proc.returncode != 0:
+            if timed_out.is_set():
+                raise Exception(f"ffmpeg: délai dépassé ({timeout}s)")
+            stderr.seek(0)
+            lines = stderr.read()[-4096:].decode(errors='replace').strip().splitlines()
+            raise Exception(f"ffmpeg a échoué ({proc.returncode}): {lines[-1] if lines else ''}")
+
+def encode_segmented(input_path, output_path, encode_args, probe, duration, progress=None):
+    """Encode une longue vidéo par segments en parallèle puis les concatène
+
+    La vidéo est découpée sans réencodage (-c copy, coupes aux images clés), chaque
+    segment est encodé dans son propre ffmpeg avec une part du budget de threads, la
+    piste audio est encodée une seule fois en parallèle, puis le tout est assemblé
+    par le démultiplexeur concat, sans réencodage.
+    """
+    has_audio = any(s.get('codec_type') == 'audio' for s in probe.get('streams', []))
+    parallel = max(1, min(VIDEO_PARALLEL_SEGMENTS, -(-int(duration) // VIDEO_SEGMENT_SECONDS)))
+    threads = max(1, VIDEO_THREADS // parallel)
+    
+    with tempfile.TemporaryDirectory(dir=UPLOAD_FOLDER) as tmp:
+        run_ffmpeg(['-i', input_path, '-map', '0:v:0', '-c', 'copy', '-f', 'segment',
+                    '-segment_time', str(VIDEO_SEGMENT_SECONDS), '-reset_timestamps', '1',
+                    os.path.join(tmp, 'src_%05d.mkv')], timeout=VIDEO_TIMEOUT)
+        segments = sorted(name for name in os.listdir(tmp) if name.startswith('src_'))
+        encoded_seconds = [0.0] * len(segments)
+        
+        def encode(index, name):
+            def segment_progress(seconds):
+                encoded_seconds[index] = seconds
+                progress(sum(encoded_seconds))
+            out = os.path.join(tmp, f'enc_{index:05d}.mkv')
+            run_ffmpeg(['-i', os.path.join(tmp, name), '-threads', str(threads)] + encode_args
+                       + ['-an', '-y', out],
+                       progress=segment_progress if progress else None, timeout=VIDEO_TIMEOUT)
+            return out
+        
+        audio_path = os.path.join(tmp, 'audio.m4a')
+        with ThreadPoolExecutor(max_workers=parallel + has_audio) as pool:
+            futures = [pool.submit(encode, index, name) for index, name in enumerate(segments)]
+            if has_audio:
+                futures.append(pool.submit(run_ffmpeg, [
+                    '-i', input_path, '-map', '0:a:0', '-c:a', 'aac', '-b:a', '128k', '-y', audio_path
+                ], timeout=VIDEO_TIMEOUT))
+            results = [future.result() for future in futures]
+        
+        list_path = os.path.join(tmp, 'segments.txt')
+        with open(list_path, 'w') as listing:
+            for path in results[:len(segments)]:
+                listing.write(f"file '{os.path.abspath(path)}'\n")
+        cmd = ['-f', 'concat', '-safe', '0', '-i', list_path]
+        if has_audio:
+            cmd += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+        run_ffmpeg(cmd + ['-c', 'copy', '-movflags', '+faststart', '-y', output_path],
+                   timeout=VIDEO_TIMEOUT)
+
+def compress_video(input_path, output_path, compression_level, max_dimension=None, progress=None):
+    """Compresse une vidéo avec ffmpeg (input_path: chemin, ou bytes envoyés sur stdin)
+
+    Une vidéo H.264 déjà assez compressée (stream_copy_possible) est simplement
+    remuxée en MP4 (-c copy). Les vidéos sur disque plus longues que
+    VIDEO_SEGMENT_MIN_DURATION sont encodées par segments en parallèle
+    (encode_segmented). progress(pourcentage) reçoit l'avancement lu sur la sortie
+    -progress de ffmpeg. Retourne le mode utilisé ('copy', 'segments' ou 'encode'),
+    ou False en cas d'échec.
+    """
     try:
+        piped = isinstance(input_path, bytes)
         # Paramètres selon le niveau
-        if compression_level == 'lossless':
-            crf = '18'
-            preset = 'slow'
-        elif compression_level == 'balanced':
-            crf = '23'
-            preset = 'medium'
-        elif compression_level == 'aggressive':
-            crf = '28'
-            preset = 'fast'
-        else:  # custom
-            crf = '23'
-            preset = 'medium'
+        crf, preset = video_params(compression_level)
+        encode_args = ['-c:v', 'libx264', '-crf', crf, '-preset', preset]
         
         # Scale si nécessaire
-        scale_filter = ''
         if max_dimension:
             max_dim = int(max_dimension)
-            scale_filter = f'-vf "scale=\'if(gt(iw,ih),{max_dim},-2)\':\'if(gt(iw,ih),-2,{max_dim})\'" '
+            encode_args.extend(['-vf', f'scale=\'if(gt(iw,ih),{max_dim},-2)\':\'if(gt(iw,ih),-2,{max_dim})\''])
         
-        cmd = [
-            'ffmpeg', '-i', input_path,
-            '-vcodec', 'libx264',
-            '-crf', crf,
-            '-preset', preset,
-            '-acodec', 'aac',
-            '-b:a', '128k'
-        ]
+        probe = probe_video(input_path)
+        duration = media_duration(probe)
+        report = None
+        if progress and duration:
+            report = lambda seconds: progress(min(99, int(100 * seconds / duration)))
         
-        if scale_filter:
-            cmd.extend(['-vf', f'scale=\'if(gt(iw,ih),{max_dim},-2)\':\'if(gt(iw,ih),-2,{max_dim})\''])
-        
-        cmd.extend(['-y', output_path])
-        
-        subprocess.run(cmd, check=True, capture_output=True)
-        return True
+        if stream_copy_possible(probe, compression_level, max_dimension):
+            run_ffmpeg(['-i', 'pipe:0' if piped else input_path, '-map', '0:v:0', '-map', '0:a?',
+                        '-c', 'copy', '-movflags', '+faststart', '-y', output_path],
+                       progress=report, stdin_data=input_path if piped else None,
+                       timeout=VIDEO_TIMEOUT)
+            return 'copy'
+        if not piped and duration and VIDEO_SEGMENT_SECONDS and duration >= VIDEO_SEGMENT_MIN_DURATION:
+            encode_segmented(input_path, output_path, encode_args, probe, duration, report)
+            return 'segments'
+        else:
+            run_ffmpeg(['-i', 'pipe:0' if piped else input_path, '-threads', str(VIDEO_THREADS)]
+                       + encode_args
+                       + ['-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', '-y', output_path],
+                       progress=report, stdin_data=input_path if piped else None,
+                       timeout=VIDEO_TIMEOUT)
+        return 'encode'
     except Exception as e:
-        print(f"Erreur compression vidéo: {e}")
+        app.logger.error("Erreur compression vidéo: %s", e)
         return False
 
-def compress_gif(input_path, output_path, compression_level, max_dimension=None):
-    """Compresse un GIF"""
+def gif_colors(compression_level):
+    """Nombre de couleurs de palette selon le niveau de compression"""
+    if compression_level == 'lossless':
+        return 256
+    elif compression_level == 'aggressive':
+        return 64
+    return 128
+
+def iter_gif_frames(img, new_size=None, tier='balanced'):
+    """Itère sur les frames composées d'un GIF: (image RGB/RGBA redimensionnée, durée)"""
+    transparent = 'transparency' in img.info or img.mode in ('RGBA', 'PA')
+    for frame_num in range(getattr(img, 'n_frames', 1)):
+        img.seek(frame_num)
+        frame = img.convert('RGBA' if transparent else 'RGB')
+        if new_size:
+            frame = resize_to(frame, new_size, tier)
+        yield frame, img.info.get('duration', 0)
+
+def build_gif_palette(img, colors, new_size=None, samples=8):
+    """Calcule une palette commune à partir de frames échantillonnées sur tout le GIF
+
+    Retourne une image 'P' utilisable par Image.quantize(palette=...). Une couleur est
+    réservée pour la transparence.
+    """
+    n_frames = getattr(img, 'n_frames', 1)
+    picks = sorted({round(i * (n_frames - 1) / max(samples - 1, 1)) for i in range(samples)})
+    thumbs = []
+    for frame_num in picks:
+        img.seek(frame_num)
+        frame = img.convert('RGB')
+        frame.thumbnail((256, 256))
+        thumbs.append(frame)
+    mosaic = Image.new('RGB', (sum(t.width for t in thumbs), max(t.height for t in thumbs)))
+    x = 0
+    for thumb in thumbs:
+        mosaic.paste(thumb, (x, 0))
+        x += thumb.width
+    img.seek(0)
+    return mosaic.quantize(colors - 1)
+
+def quantize_gif_frame(frame, colors, palette=None, unchanged=None):
+    """Quantifie une frame en mode 'P' (palette commune ou adaptative)
+
+    Les pixels transparents (RGBA) ou inchangés depuis la frame précédente (masque
+    `unchanged`) prennent un index transparent, ce qui compresse bien mieux en LZW.
+    Retourne (image P, index de transparence ou None). Exécuté dans un thread: la
+    quantification Pillow relâche le GIL.
+    """
+    if frame.mode == 'RGBA':
+        mask = frame.getchannel('A').point(lambda a: 255 if a < 128 else 0)
+        frame = frame.convert('RGB')
+    else:
+        mask = unchanged
+    if palette is not None:
+        out = frame.quantize(palette=palette, dither=Image.Dither.NONE)
+    else:
+        out = frame.quantize(colors - 1 if mask is not None else colors)
+    transparency = None
+    if mask is not None and mask.getbbox():
+        palette_bytes = bytes(out.getpalette())
+        transparency = len(palette_bytes) // 3
+        out.putpalette(palette_bytes + b'\0\0\0')
+        out.paste(transparency, mask=mask)
+    return out, transparency
+
+def _gif_header(size, palette_bytes, loop):
+    """En-tête GIF89a: écran logique, table de couleurs globale et boucle NETSCAPE"""
+    entries = max(len(palette_bytes) // 3, 2)
+    bits = max((entries - 1).bit_length(), 1)
+    palette_bytes = palette_bytes.ljust((1 << bits) * 3, b'\0')
+    header = b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0x80 | (bits - 1), 0, 0)
+    header += palette_bytes
+    if loop is not None:
+        header += b'!\xff\x0bNETSCAPE2.0' + struct.pack('<BBHB', 3, 1, loop, 0)
+    return header
+
+def write_gif_stream(output_path, frames, size, colors, shared_palette=None, loop=0, threads=1):
+    """Quantifie et écrit un GIF animé au fil de l'eau
+
+    frames: itérable de (image RGB/RGBA, durée). Les frames identiques sont fusionnées,
+    seule la zone modifiée depuis la frame précédente est encodée, et au plus
+    2 x threads frames sont en mémoire à la fois.
+    """
+    with open(output_path, 'wb') as fp, ThreadPoolExecutor(max_workers=threads) as pool:
+        window = deque()
+        state = {'header': False}
+        
+        def write_next():
+            future, duration, offset = window.popleft()
+            frame, transparency = future.result()
+            params = {'duration': duration}
+            if not state['header']:
+                fp.write(_gif_header(size, bytes(frame.getpalette()), loop))
+                state['header'] = True
+            elif shared_palette is None:
+                params['include_color_table'] = True
+            if offset is None:
+                # Frame RGBA: complète, restaurée au fond avant la suivante
+                params['disposal'] = 2
+                offset = (0, 0)
+            else:
+                params['disposal'] = 1
+            if transparency is not None:
+                params['transparency'] = transparency
+            for chunk in GifImagePlugin.getdata(frame, offset, **params):
+                fp.write(chunk)
+        
+        def submit(frame, duration, offset, unchanged):
+            if len(window) >= 2 * threads:
+                write_next()
+            window.append((pool.submit(quantize_gif_frame, frame, colors, shared_palette, unchanged),
+                           duration, offset))
+        
+        previous = None
+        pending = None
+        for frame, duration in frames:
+            if frame.mode == 'RGBA':
+                item = [frame, duration, None, None]
+            elif previous is None:
+                item = [frame, duration, (0, 0), None]
+            else:
+                diff = ImageChops.difference(previous, frame)
+                bbox = diff.getbbox()
+                if bbox is None:
+                    pending[1] += duration
+                    continue
+                diff = diff.crop(bbox)
+                changed = ImageChops.lighter(ImageChops.lighter(*diff.split()[:2]), diff.getchannel(2))
+                unchanged = changed.point(lambda v: 255 if v == 0 else 0)
+                item = [frame.crop(bbox), duration, bbox[:2], unchanged]
+            previous = frame
+            if pending is not None:
+                submit(*pending)
+            pending = item
+        if pending is not None:
+            submit(*pending)
+        while window:
+            write_next()
+        fp.write(b';')
+
+def compress_gif(input_path, output_path, compression_level, max_dimension=None, shared_palette=None,
+                 resize_tier=None):
+    """Compresse un GIF (input_path: chemin ou objet fichier)
+
+    Les GIF animés passent par write_gif_stream: chaque frame est redimensionnée puis
+    quantifiée en parallèle, avec une palette commune si shared_palette (par défaut:
+    GIF_SHARED_PALETTE) ou une palette adaptative par frame. resize_tier: niveau de
+    RESIZE_TIERS (par défaut celui du niveau de compression).
+    """
+    if shared_palette is None:
+        shared_palette = GIF_SHARED_PALETTE
+    tier = resize_tier or RESIZE_TIER_BY_LEVEL.get(compression_level, 'balanced')
     try:
         with Image.open(input_path) as img:
-            frames = []
-            
             # Paramètres de réduction de palette
-            if compression_level == 'lossless':
-                colors = 256
-            elif compression_level == 'balanced':
-                colors = 128
-            elif compression_level == 'aggressive':
-                colors = 64
-            else:
-                colors = 128
+            colors = gif_colors(compression_level)
             
             # Redimensionner si nécessaire
-            if max_dimension:
-                max_dim = int(max_dimension)
-                if max(img.size) > max_dim:
-                    ratio = max_dim / max(img.size)
-                    new_size = (int(img.width * ratio), int(img.height * ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
+            new_size = fit_size(img.size, int(max_dimension)) if max_dimension else None
             
             # Pour les GIF animés
             if getattr(img, 'is_animated', False):
-                frames = []
-                for frame_num in range(img.n_frames):
-                    img.seek(frame_num)
-                    frame = img.convert('P', palette=Image.ADAPTIVE, colors=colors)
-                    frames.append(frame)
-                
-                frames[0].save(
+                palette = build_gif_palette(img, colors, new_size) if shared_palette else None
+                write_gif_stream(
                     output_path,
-                    save_all=True,
-                    append_images=frames[1:],
-                    optimize=True,
-                    loop=0
+                    iter_gif_frames(img, new_size, tier),
+                    new_size or img.size,
+                    colors,
+                    shared_palette=palette,
+                    loop=img.info.get('loop', 0),
+                    threads=GIF_THREADS
                 )
             else:
                 # GIF statique
+                if new_size:
+                    img = resize_to(img.convert('RGBA' if 'transparency' in img.info else 'RGB'), new_size, tier)
                 img = img.convert('P', palette=Image.ADAPTIVE, colors=colors)
                 img.save(output_path, 'GIF', optimize=True)
             
             return True
     except Exception as e:
-        print(f"Erreur compression GIF: {e}")
+        app.logger.error("Erreur compression GIF: %s", e)
         return False
 
+# Page d'accueil encodée et précompressée une fois par processus: (ETag, {encodage: octets})
+_ui_assets = None
+
+def ui_assets():
+    """Interface précompressée (gzip, et brotli si le module est installé), calculée au premier appel"""
+    global _ui_assets
+    if _ui_assets is None:
+        with _lazy_lock:
+            if _ui_assets is None:
+                body = HTML_INTERFACE.encode()
+                assets = {'gzip': gzip.compress(body, 9, mtime=0), 'identity': body}
+                try:
+                    import brotli
+                    assets = dict(br=brotli.compress(body, quality=11), **assets)
+                except ImportError:
+                    pass
+                _ui_assets = hashlib.sha256(body).hexdigest()[:16], assets
+    return _ui_assets
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_INTERFACE)
+    etag, assets = ui_assets()
+    # Encodages dans l'ordre de préférence: br, gzip, puis sans compression
+    encoding = next(name for name in assets if name == 'identity' or request.accept_encodings[name])
+    response = Response(assets[encoding], mimetype='text/html')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={UI_MAX_AGE}'
+    response.set_etag(f'{etag}-{encoding}')
+    return response.make_conditional(request)
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff']
+# Formats de sortie conservés tels quels (les autres images sont converties en WebP)
+ENCODER_BY_EXTENSION = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.webp': 'webp'}
+VIDEO_EXTENSIONS = ['.mp4', '.mov', '.avi', '.webm', '.mkv']
+# Conteneurs lisibles séquentiellement par ffmpeg (pas d'index en fin de fichier)
+PIPE_VIDEO_EXTENSIONS = ['.webm', '.mkv']
+# Détection du type réel: octets lus en tête d'upload, et extensions acceptées pour chaque
+# type détecté (la première sert quand le nom ne correspond pas)
+SNIFF_BYTES = 64
+SNIFFED_EXTENSIONS = {
+    'jpeg': ['.jpg', '.jpeg'],
+    'png': ['.png'],
+    'webp': ['.webp'],
+    'gif': ['.gif'],
+    'bmp': ['.bmp'],
+    'tiff': ['.tif', '.tiff'],
+    'mp4': ['.mp4', '.mov'],
+    'mov': ['.mov', '.mp4'],
+    'matroska': ['.mkv', '.webm'],
+    'webm': ['.webm', '.mkv'],
+    'avi': ['.avi'],
+}
+# Boîtes ISO-BMFF de tête des anciens QuickTime, sans boîte ftyp
+QUICKTIME_BOXES = {b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+# Marques ftyp d'images (AVIF, HEIF): même conteneur que le MP4, mais pas des vidéos
+IMAGE_BRANDS = {b'avif', b'avis', b'heic', b'heix', b'hevc', b'mif1', b'msf1'}
+
+def sniff_media(head):
+    """Identifie le format d'après les premiers octets du fichier, None s'il n'est pas pris en charge"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'webp'
+    if head.startswith(b'RIFF') and head[8:12] == b'AVI ':
+        return 'avi'
+    if head.startswith(b'BM') and len(head) >= 26:
+        return 'bmp'
+    if head.startswith((b'II*\x00', b'MM\x00*')):
+        return 'tiff'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in IMAGE_BRANDS:
+            return None
+        return 'mov' if brand == b'qt  ' else 'mp4'
+    if head[4:8] in QUICKTIME_BOXES:
+        return 'mov'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        # En-tête EBML: le DocType ("webm" ou "matroska") suit de près
+        return 'webm' if b'webm' in head else 'matroska'
+    return None
+
+def sniffed_filename(filename, head):
+    """Nom du fichier avec l'extension de son type réel
+
+    Un nom sans extension (secure_filename) ou mal étiqueté est corrigé; lève ValueError
+    si le contenu n'est pas un format pris en charge.
+    """
+    kind = sniff_media(head)
+    if kind is None:
+        raise ValueError("Fichier vide" if not head else "Type de fichier non reconnu ou non pris en charge")
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() in SNIFFED_EXTENSIONS[kind]:
+        return filename
+    return (stem or 'fichier') + SNIFFED_EXTENSIONS[kind][0]
+
+def plan_output(filename, compression_level, auto_format=False):
+    """Détermine le type de média, l'extension et le nom du fichier de sortie
+
+    En format automatique, l'extension des images n'est connue qu'après encodage:
+    output_ext vaut None et le nom est retourné sans extension.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        if auto_format:
+            return 'image', None, filename.rsplit('.', 1)[0]
+        if ext == '.png' and compression_level != 'lossless':
+            output_ext = '.webp'
+        elif ext in ENCODER_BY_EXTENSION:
+            output_ext = ext
+        else:
+            output_ext = '.webp'
+        return 'image', output_ext, filename.rsplit('.', 1)[0] + output_ext
+    if ext in VIDEO_EXTENSIONS:
+        return 'video', '.mp4', filename.rsplit('.', 1)[0] + '_compressed.mp4'
+    if ext == '.gif':
+        return 'gif', ext, filename
+    raise Exception(f"Format non supporté: {ext}")
+
+def parse_variants(sizes, formats=None):
+    """Lit les champs variantSizes ('600,800,1080') et variantFormats ('webp,avif')
+
+    Retourne {'sizes': [...décroissantes], 'formats': [...]}, ou None sans variantes;
+    lève ValueError si les valeurs sont invalides.
+    """
+    if not sizes:
+        return None
+    try:
+        sizes = sorted({int(size) for size in sizes.split(',') if size.strip()}, reverse=True)
+    except ValueError:
+        raise ValueError("Tailles de variantes invalides (ex: 600,800,1080)")
+    if not sizes or sizes[-1] <= 0 or len(sizes) > MAX_VARIANT_SIZES:
+        raise ValueError(f"Entre 1 et {MAX_VARIANT_SIZES} tailles de variantes positives attendues")
+    formats = [name.strip().lower() for name in (formats or '').split(',') if name.strip()]
+    Image.init()  # Image.SAVE n'est complet qu'une fois tous les plugins chargés
+    unknown = [name for name in formats
+               if name not in IMAGE_ENCODERS or IMAGE_ENCODERS[name][1].upper() not in Image.SAVE]
+    if unknown:
+        raise ValueError(f"Formats de variantes inconnus ou indisponibles: {', '.join(unknown)}")
+    return {'sizes': sizes, 'formats': list(dict.fromkeys(formats))}
+
+# Champs communs à tous les résultats: le reste (passthrough, quality, video_mode...) est
+# propre au fichier et mémorisé avec son entrée de cache
+BASE_RESULT_KEYS = ('success', 'original_name', 'output_format', 'original_size', 'compressed_size',
+                    'reduction', 'saved', 'download_url')
+
+def build_result(filename, output_ext, original_size, output_path, **extra):
+    """Construit le résultat JSON d'un fichier compressé"""
+    compressed_size = os.path.getsize(output_path)
+    result = {
+        'success': True,
+        'original_name': filename,
+        'output_format': output_ext,
+        'original_size': original_size,
+        'compressed_size': compressed_size,
+        'reduction': round((1 - compressed_size/original_size) * 100),
+        'saved': original_size - compressed_size,
+        'download_url': download_url(output_path)
+    }
+    result.update(extra)
+    return result
+
+def download_url(path):
+    """URL de téléchargement d'un fichier de OUTPUT_FOLDER"""
+    return '/download/' + os.path.relpath(path, OUTPUT_FOLDER).replace(os.sep, '/')
+
+def output_file(url):
+    """Chemin sur disque correspondant à une URL de download_url()"""
+    return os.path.join(OUTPUT_FOLDER, *url[len('/download/'):].split('/'))
+
+def is_job_id(name):
+    """Vrai pour un identifiant de job (uuid4 hexadécimal), et donc un nom de dossier de job"""
+    return len(name) == 32 and all(c in '0123456789abcdef' for c in name)
+
+def unique_filename(filename, taken):
+    """Rend le nom unique dans un lot: les sorties d'un job partagent un dossier
+
+    La comparaison porte sur le nom sans extension (photo.png et photo.webp donneraient
+    toutes deux photo.webp), sans tenir compte de la casse.
+    """
+    stem, ext = os.path.splitext(filename)
+    candidate, n = stem, 1
+    while candidate.lower() in taken:
+        n += 1
+        candidate = f'{stem}_{n}'
+    taken.add(candidate.lower())
+    return candidate + ext
+
+def copy_source(source, output_path):
+    """Écrit le fichier d'origine (chemin ou bytes) vers output_path"""
+    if isinstance(source, bytes):
+        with open(output_path, 'wb') as out:
+            out.write(source)
+    else:
+        shutil.copyfile(source, output_path)
+
+def original_fits(source, kind, settings, max_dimension=None):
+    """Le fichier d'origine peut-il remplacer une sortie qui n'est pas plus légère?
+
+    Non s'il fallait le réduire (max_dimension). Avec la politique 'strip', les
+    métadonnées d'une image doivent pouvoir être retirées sans réencodage (voir
+    write_original): JPEG sans rotation EXIF ni profil large gamut, ou image sans
+    métadonnées. En format automatique, l'original concourt ainsi avec les encodeurs.
+    """
+    if kind == 'video':
+        if not max_dimension:
+            return True
+        video = next(s for s in probe_video(source)['streams'] if s.get('codec_type') == 'video')
+        return max(video['width'], video['height']) <= int(max_dimension)
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        if max_dimension and max(img.size) > int(max_dimension):
+            return False
+        if kind == 'image' and settings.get('metadata', METADATA_POLICY) == 'strip':
+            meta = read_metadata(img)
+            if meta['bytes'] and (img.format != 'JPEG' or meta['orientation'] != 1
+                                  or (meta['icc'] and not is_srgb(meta['icc']))):
+                return False
+    return True
+
+def write_original(source, output_path, strip=False):
+    """Sert le fichier d'origine comme sortie; avec strip, un JPEG est débarrassé de ses
+    métadonnées sans réencodage. Retourne les octets de métadonnées retirés"""
+    if not strip:
+        copy_source(source, output_path)
+        return 0
+    if isinstance(source, bytes):
+        data = source
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+    if data.startswith(b'\xff\xd8'):
+        data = strip_jpeg_metadata(data)
+    with open(output_path, 'wb') as out:
+        out.write(data)
+    return (len(source) if isinstance(source, bytes) else os.path.getsize(source)) - len(data)
+
+def remove_quietly(path):
+    """Supprime un fichier s'il existe encore"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# Avancement remonté par les workers: (clé de progression, pourcentage)
+_progress_queue = None
+
+def _init_worker(progress_queue, niceness=0):
+    """Initialise un worker du pool (niceness: priorité abaissée, héritée par ffmpeg)"""
+    global _progress_queue
+    _progress_queue = progress_queue
+    if niceness and hasattr(os, 'nice'):
+        os.nice(niceness)
+
+def make_progress_reporter(progress_key):
+    """Fonction progress(pourcentage) qui remonte l'avancement au processus principal"""
+    if progress_key is None or _progress_queue is None:
+        return None
+    last = [None]
+    
+    def report(percent):
+        if percent != last[0]:
+            last[0] = percent
+            _progress_queue.put((progress_key, percent))
+    return report
+
+def process_file(source, filename, compression_level, settings, max_dimension=None, progress_key=None,
+                 output_dir=OUTPUT_FOLDER, keep_source=False):
+    """Compresse un fichier uploadé et retourne son résultat (exécuté dans un worker)
+
+    source: chemin dans UPLOAD_FOLDER (supprimé ensuite, sauf keep_source), ou contenu en mémoire (bytes)
+    progress_key: (job_id, index) pour remonter l'avancement des vidéos
+    output_dir: dossier du job où écrire la sortie
+    """
+    _stage_timings.clear()
+    in_memory = isinstance(source, bytes)
+    try:
+        original_size = len(source) if in_memory else os.path.getsize(source)
+        auto_format = settings.get('output_format') == 'auto'
+        kind, output_ext, output_name = plan_output(filename, compression_level, auto_format)
+        output_path = os.path.join(output_dir, output_name)
+        
+        info = {}
+        pass_through = False
+        variants = kind == 'image' and settings.get('variants')
+        if kind == 'image' and not auto_format and not settings.get('target_ssim') and not variants:
+            with stage('decode'):
+                pass_through = can_pass_through(io.BytesIO(source) if in_memory else source,
+                                                output_ext, settings, max_dimension)
+        if variants:
+            output_path, output_ext, info = compress_variants(io.BytesIO(source) if in_memory else source,
+                                                              filename, output_ext, settings, output_dir)
+        
+        elif pass_through:
+            # Réencoder ne peut pas gagner: le fichier d'origine est servi tel quel, au
+            # besoin débarrassé de ses métadonnées sans réencodage
+            with stage('encode'):
+                saved = write_original(source, output_path, settings.get('metadata', METADATA_POLICY) == 'strip')
+            if saved:
+                info['metadata_saved'] = saved
+            info['passthrough'] = True
+            
+        elif kind == 'image':
+            info = smart_compress_image(io.BytesIO(source) if in_memory else source,
+                                        output_path, settings, max_dimension, auto_format)
+            if auto_format:
+                output_ext = info.pop('output_ext')
+                output_path += output_ext
+            
+        elif kind == 'video':
+            with stage('ffmpeg'):
+                mode = compress_video(source, output_path, compression_level, max_dimension,
+                                      make_progress_reporter(progress_key))
+            if not mode:
+                raise Exception("Échec compression vidéo")
+            info['video_mode'] = mode
+            
+        elif kind == 'gif':
+            # Frames décodées, quantifiées et écrites en flux: une seule étape
+            with stage('encode'):
+                if not compress_gif(io.BytesIO(source) if in_memory else source,
+                                    output_path, compression_level, max_dimension,
+                                    resize_tier=settings.get('resize')):
+                    raise Exception("Échec compression GIF")
+        
+        # Sortie plus lourde que l'original: on garde l'original (sauf variantes, qui
+        # sont des déclinaisons demandées explicitement, et sorties redimensionnées)
+        if (not variants and os.path.getsize(output_path) >= original_size
+                and original_fits(source, kind, settings, max_dimension)):
+            with stage('cleanup'):
+                original_ext = os.path.splitext(filename)[1].lower()
+                fallback_path = os.path.splitext(output_path)[0] + original_ext
+                if fallback_path != output_path:
+                    os.remove(output_path)
+                # Métadonnées retirées de l'original servi, pas de la sortie abandonnée
+                info.pop('metadata_saved', None)
+                info.pop('encoder', None)
+                saved = write_original(source, fallback_path,
+                                       kind == 'image' and settings.get('metadata', METADATA_POLICY) == 'strip')
+            if saved:
+                info['metadata_saved'] = saved
+            output_path, output_ext = fallback_path, original_ext
+            info['passthrough'] = True
+        
+        result = build_result(filename, output_ext, original_size, output_path, **info)
+    except Exception as e:
+        if isinstance(e, (Image.DecompressionBombError, Image.DecompressionBombWarning)):
+            error = f"Image refusée: plus de {MAX_IMAGE_PIXELS} pixels (MAX_IMAGE_PIXELS)"
+        else:
+            error = str(e)
+        result = {
+            'success': False,
+            'original_name': filename,
+            'error': error
+        }
+    finally:
+        # Cleanup: l'upload est supprimé même en cas d'échec
+        if not in_memory and not keep_source:
+            with stage('cleanup'):
+                remove_quietly(source)
+    result['timings'] = dict(_stage_timings)
+    return result
+
+def compress_path(input_path, output_dir, compression_level='balanced', quality=None, max_dimension=None,
+                  output_format=None, target_ssim=None, filename=None, metadata=None, resize_tier=None):
+    """Compresse un fichier du disque dans output_dir, sans toucher à l'original
+
+    API Python (utilisée par cli.py): mêmes réglages, même détection du type réel et même
+    résultat que POST /compress, avec output_path à la place de download_url.
+    filename: nom de la sortie avant changement d'extension (par défaut celui de l'entrée).
+    metadata: 'strip' ou 'keep' (METADATA_POLICY par défaut).
+    resize_tier: niveau de RESIZE_TIERS (par défaut celui du niveau de compression).
+    """
+    filename = filename or os.path.basename(input_path)
+    with open(input_path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    try:
+        filename = sniffed_filename(filename, head)
+    except ValueError as e:
+        return {'success': False, 'rejected': True, 'original_name': filename, 'error': str(e)}
+    settings = get_compression_settings(compression_level, quality, target_ssim)
+    if output_format == 'auto':
+        settings = dict(settings, output_format='auto')
+    if metadata not in (None, *METADATA_POLICIES):
+        raise ValueError(f"Politique de métadonnées inconnue: {metadata} (strip ou keep)")
+    settings = dict(settings, metadata=metadata or METADATA_POLICY)
+    if resize_tier not in (None, *RESIZE_TIERS):
+        raise ValueError(f"Niveau de redimensionnement inconnu: {resize_tier} ({', '.join(RESIZE_TIERS)})")
+    if resize_tier:
+        settings = dict(settings, resize=resize_tier)
+    os.makedirs(output_dir, exist_ok=True)
+    result = process_file(input_path, filename, compression_level,
+                          settings, max_dimension, output_dir=output_dir,
+                          keep_source=True)
+    if result['success']:
+        # Les sorties sont toutes écrites dans output_dir, hors de OUTPUT_FOLDER
+        result['output_path'] = os.path.join(output_dir, result.pop('download_url').rsplit('/', 1)[1])
+    return result
+
+# --- Cache de résultats -----------------------------------------------------
+# Les sorties sont indexées par l'empreinte du fichier uploadé et les paramètres
+# résolus: un fichier déjà traité est resservi sans passer par Pillow ni ffmpeg.
+# L'index LRU est reconstruit au démarrage à partir des dates d'accès sur disque.
+
+cache_lock = threading.Lock()
+cache_index = OrderedDict()
+cache_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'bytes': 0}
+
+def _load_cache_index():
+    """Reconstruit l'index LRU à partir du dossier de cache"""
+    entries = []
+    for entry in os.scandir(CACHE_FOLDER):
+        # Les fiches .json accompagnent leur sortie, elles ne sont pas des entrées
+        if entry.is_file() and not entry.name.endswith('.json'):
+            stat = entry.stat()
+            entries.append((stat.st_atime, entry.name, stat.st_size))
+    for _, name, size in sorted(entries):
+        cache_index[os.path.splitext(name)[0]] = (name, size)
+        cache_stats['bytes'] += size
+
+def ingest_upload(file, path, in_memory=True, head=b''):
+    """Lit un upload par blocs en calculant son empreinte SHA-256 au passage
+
+    Le contenu reste en mémoire tant qu'il ne dépasse ni SPOOL_MAX_BYTES ni le budget
+    INGEST_MEMORY_BYTES, puis bascule vers `path`; un UploadSpool resté en mémoire est
+    repris sans copie. head: premiers octets déjà lus du flux (détection du type).
+    Retourne (source, taille, empreinte, réservation), source étant les bytes du fichier
+    ou le chemin sur disque, réservation les octets du budget à rendre une fois le
+    fichier traité (release_ingest_memory).
+    """
+    if in_memory and isinstance(file.stream, UploadSpool):
+        data, reserved = file.stream.take()
+        if data is not None:
+            return data, len(data), hashlib.sha256(data).hexdigest(), reserved
+    digest = hashlib.sha256()
+    size = 0
+    reserved = 0
+    buffer = io.BytesIO()
+    out = None
+    try:
+        while True:
+            chunk = head or file.stream.read(CHUNK_SIZE)
+            head = b''
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            if out is None and (not in_memory or size > SPOOL_MAX_BYTES
+                                or not claim_ingest_memory(len(chunk))):
+                out = open(path, 'wb')
+                out.write(buffer.getbuffer())
+                buffer = None
+                release_ingest_memory(reserved)
+                reserved = 0
+            if out is None:
+                reserved += len(chunk)
+                buffer.write(chunk)
+            else:
+                out.write(chunk)
+    except BaseException:
+        # Upload interrompu: ne pas laisser de fichier partiel
+        release_ingest_memory(reserved)
+        if out is not None:
+            out.close()
+            remove_quietly(path)
+        raise
+    finally:
+        if out is not None:
+            out.close()
+    source = path if out is not None else buffer.getvalue()
+    return source, size, digest.hexdigest(), reserved
+
+# Octets d'uploads tenus en mémoire par ce processus, bornés par INGEST_MEMORY_BYTES
+ingest_lock = threading.Lock()
+_ingest_bytes = 0
+
+def claim_ingest_memory(size):
+    """Réserve size octets du budget mémoire d'ingestion; False s'il est épuisé"""
+    global _ingest_bytes
+    with ingest_lock:
+        if _ingest_bytes + size > INGEST_MEMORY_BYTES:
+            return False
+        _ingest_bytes += size
+        return True
+
+def release_ingest_memory(size):
+    """Rend au budget mémoire d'ingestion les octets d'un upload libéré"""
+    global _ingest_bytes
+    if size:
+        with ingest_lock:
+            _ingest_bytes -= size
+
+class UploadSpool:
+    """Réceptacle d'un fichier multipart, en mémoire tant qu'il ne dépasse ni
+    SPOOL_MAX_BYTES ni le budget INGEST_MEMORY_BYTES, sinon dans un fichier temporaire
+
+    Le type est détecté sur les SNIFF_BYTES premiers octets dès leur arrivée: d'un
+    contenu non pris en charge, seuls ces octets sont gardés (pour le message d'erreur),
+    la suite de la partie est lue du corps de la requête mais jetée.
+    """
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.file = None  # fichier temporaire, une fois la mémoire refusée
+        self.reserved = 0  # octets du budget tenus par buffer
+        self.head = b''
+        self.sniffed = False
+        self.rejected = False
+    
+    def _store(self, data):
+        if self.file is None:
+            if self.reserved + len(data) <= SPOOL_MAX_BYTES and claim_ingest_memory(len(data)):
+                self.reserved += len(data)
+                return self.buffer.write(data)
+            self.file = tempfile.TemporaryFile()
+            self.file.write(self.buffer.getbuffer())
+            self.buffer = None
+            release_ingest_memory(self.reserved)
+            self.reserved = 0
+        return self.file.write(data)
+    
+    def _sniff(self):
+        self.sniffed = True
+        self.rejected = sniff_media(self.head[:SNIFF_BYTES]) is None
+        self._store(self.head[:SNIFF_BYTES] if self.rejected else self.head)
+        self.head = b''
+    
+    def write(self, data):
+        if self.rejected:
+            return len(data)
+        if self.sniffed:
+            return self._store(data)
+        self.head += data
+        if len(self.head) >= SNIFF_BYTES:
+            self._sniff()
+        return len(data)
+    
+    def seek(self, *args):
+        # Fin de la partie: un fichier plus court que SNIFF_BYTES est détecté ici
+        if not self.sniffed:
+            self._sniff()
+        return (self.file or self.buffer).seek(*args)
+    
+    def take(self):
+        """Contenu resté en mémoire, sans copie, et sa réservation du budget, que
+        l'appelant doit rendre (release_ingest_memory); (None, 0) s'il est sur disque"""
+        if self.file is not None:
+            return None, 0
+        data, reserved = self.buffer.getvalue(), self.reserved
+        self.reserved = 0
+        return data, reserved
+    
+    def close(self):
+        release_ingest_memory(self.reserved)
+        self.reserved = 0
+        if self.file is not None:
+            self.file.close()
+    
+    def __getattr__(self, name):
+        return getattr(self.file or self.buffer, name)
+
+class UploadRequest(Request):
+    """Requête dont les fichiers multipart sont reçus dans un UploadSpool
+
+    Werkzeug bascule par défaut chaque partie de plus de 500 Ko dans un fichier
+    temporaire, avant même que ingest_upload ne la lise.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool()
+
+app.request_class = UploadRequest
+
+def keep_in_memory(filename):
+    """Indique si un upload peut être traité sans passer par UPLOAD_FOLDER"""
+    if INGEST_MODE != 'memory':
+        return False
+    ext = os.path.splitext(filename)[1].lower()
+    return ext not in VIDEO_EXTENSIONS or ext in PIPE_VIDEO_EXTENSIONS
+
+def cache_key(digest, filename, compression_level, settings, max_dimension=None):
+    """Clé de cache: contenu + paramètres résolus (None si le format n'est pas supporté)"""
+    try:
+        kind, output_ext, _ = plan_output(filename, compression_level,
+                                          settings.get('output_format') == 'auto')
+    except Exception:
+        return None
+    params = json.dumps({
+        'version': CACHE_VERSION,
+        'kind': kind,
+        'output_ext': output_ext,
+        'level': compression_level,
+        'settings': settings,
+        'max_dimension': int(max_dimension) if max_dimension else None
+    }, sort_keys=True)
+    return hashlib.sha256(f'{digest}:{params}'.encode()).hexdigest()
+
+def _adopt_cache_file(key):
+    """Indexe une entrée écrite par un autre processus serveur (à appeler sous cache_lock)"""
+    extensions = set(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS + ['.gif', '.mp4'])
+    extensions.update(ext for ext, _, _ in IMAGE_ENCODERS.values())
+    for ext in extensions:
+        name = key + ext
+        try:
+            size = os.path.getsize(os.path.join(CACHE_FOLDER, name))
+        except OSError:
+            continue
+        cache_index[key] = (name, size)
+        cache_stats['bytes'] += size
+        return cache_index[key]
+    return None
+
+def cache_lookup(key):
+    """Retourne le chemin de la sortie en cache pour cette clé, ou None"""
+    with cache_lock:
+        entry = cache_index.get(key)
+        if entry is None and WEB_WORKERS > 1:
+            entry = _adopt_cache_file(key)
+        if entry is None:
+            cache_stats['misses'] += 1
+            return None
+        path = os.path.join(CACHE_FOLDER, entry[0])
+        try:
+            os.utime(path)  # date d'accès: ordre LRU au prochain démarrage
+        except OSError:
+            # Évincée entre-temps (par un autre processus): un échec, pas une erreur
+            del cache_index[key]
+            cache_stats['bytes'] -= entry[1]
+            cache_stats['misses'] += 1
+            return None
+        cache_index.move_to_end(key)
+        cache_stats['hits'] += 1
+    return path
+
+def _extras_path(key):
+    """Fiche JSON des champs propres au résultat d'une entrée de cache"""
+    return os.path.join(CACHE_FOLDER, key + '.json')
+
+def cache_store(key, output_path, extras=None):
+    """Copie une sortie dans le cache puis évince les entrées les moins récentes
+
+    extras: champs du résultat hors BASE_RESULT_KEYS, rendus par serve_cached.
+    """
+    # Copie plutôt que lien dur: une sortie réécrite plus tard ne doit pas altérer le cache
+    name = key + os.path.splitext(output_path)[1]
+    size = os.path.getsize(output_path)
+    if size > CACHE_PROCESS_BYTES:
+        return
+    # Fiche écrite avant la sortie: une entrée visible a toujours ses champs
+    with open(_extras_path(key) + '.tmp', 'w') as f:
+        json.dump(extras or {}, f)
+    os.replace(_extras_path(key) + '.tmp', _extras_path(key))
+    tmp_path = os.path.join(CACHE_FOLDER, f'.{name}.tmp')
+    shutil.copyfile(output_path, tmp_path)
+    os.replace(tmp_path, os.path.join(CACHE_FOLDER, name))
+    with cache_lock:
+        previous = cache_index.pop(key, None)
+        if previous:
+            cache_stats['bytes'] -= previous[1]
+        cache_index[key] = (name, size)
+        cache_stats['bytes'] += size
+        cache_stats['stores'] += 1
+        evicted = []
+        while cache_stats['bytes'] > CACHE_PROCESS_BYTES and cache_index:
+            _, (old_name, old_size) = cache_index.popitem(last=False)
+            cache_stats['bytes'] -= old_size
+            cache_stats['evictions'] += 1
+            evicted.append(old_name)
+    for old_name in evicted:
+        remove_quietly(os.path.join(CACHE_FOLDER, old_name))
+        remove_quietly(_extras_path(os.path.splitext(old_name)[0]))
+
+# Qualités trouvées en mode 'target', par contenu: un fichier déjà analysé est
+# réencodé directement sans nouvelle recherche
+quality_cache = OrderedDict()
+
+def quality_cache_key(digest, settings, max_dimension=None, encoder=None):
+    """Clé du cache de qualité (None hors mode 'target' ou sans encodeur unique)"""
+    if not settings.get('target_ssim') or not encoder:
+        return None
+    return f"{digest}:{encoder}:{settings['target_ssim']}:{max_dimension or ''}"
+
+def search_encoder(filename, compression_level, settings):
+    """Encodeur unique visé par la recherche de qualité d'une image
+
+    None si plusieurs encodeurs ont chacun leur qualité (mode 'auto', variantes
+    multi-formats) ou si le fichier n'est pas une image.
+    """
+    variants = settings.get('variants')
+    auto_format = settings.get('output_format') == 'auto'
+    if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS or (auto_format and not variants):
+        return None
+    _, output_ext, _ = plan_output(filename, compression_level, auto_format)
+    names = (variants and variants['formats']) or [ENCODER_BY_EXTENSION[output_ext] if output_ext else 'webp']
+    return names[0] if len(names) == 1 else None
+
+def cached_quality(key):
+    """Qualité déjà trouvée pour cette clé, ou None"""
+    with cache_lock:
+        quality = quality_cache.get(key)
+        if quality is not None:
+            quality_cache.move_to_end(key)
+        return quality
+
+def store_quality(key, quality):
+    """Mémorise la qualité trouvée pour un contenu"""
+    with cache_lock:
+        quality_cache[key] = quality
+        quality_cache.move_to_end(key)
+        while len(quality_cache) > QUALITY_CACHE_SIZE:
+            quality_cache.popitem(last=False)
+
+def serve_cached(cached_path, source, filename, compression_level, original_size, auto_format=False,
+                 output_dir=OUTPUT_FOLDER):
+    """Construit le résultat d'un fichier servi depuis le cache"""
+    _, output_ext, output_name = plan_output(filename, compression_level, auto_format)
+    # L'extension en cache fait foi: format automatique ou original conservé
+    cached_ext = os.path.splitext(cached_path)[1]
+    if output_ext != cached_ext:
+        output_name = (output_name if output_ext is None else os.path.splitext(output_name)[0]) + cached_ext
+        output_ext = cached_ext
+    output_path = os.path.join(output_dir, output_name)
+    shutil.copyfile(cached_path, output_path)
+    # Champs propres au fichier (passthrough, metadata_saved, quality...), comme à la
+    # première compression; une entrée sans fiche n'en a pas
+    try:
+        with open(_extras_path(os.path.splitext(os.path.basename(cached_path))[0])) as f:
+            extras = json.load(f)
+    except (OSError, ValueError):
+        extras = {}
+    if not isinstance(source, bytes):
+        remove_quietly(source)
+    return build_result(filename, output_ext, original_size, output_path, **dict(extras, cached=True))
+
+storage_lock = threading.Lock()
+_storage_ready = False
+
+def init_storage(fresh=False):
+    """Crée les dossiers de données et charge l'index du cache, une fois par processus
+
+    Appelée par les points d'entrée web (serve, puis première requête) plutôt qu'à
+    l'import: cli.py, bench.py et les workers importent ce module sans toucher au
+    dossier courant. fresh: repartir de métriques vides (démarrage du serveur).
+    """
+    global _storage_ready
+    if _storage_ready:
+        return
+    with storage_lock:
+        if _storage_ready:
+            return
+        for folder in DATA_FOLDERS:
+            os.makedirs(folder, exist_ok=True)
+        if fresh:
+            for stale in os.listdir(METRICS_FOLDER):
+                os.remove(os.path.join(METRICS_FOLDER, stale))
+        _load_cache_index()
+        _storage_ready = True
+
+# --- File de jobs -----------------------------------------------------------
+# Les fichiers sont enregistrés pendant la requête puis compressés par le pool de
+# processus de leur voie (image, gif, video); l'état des jobs vit dans ce processus et
+# se consulte via /jobs/<id>.
+# Avec plusieurs processus serveur, chaque état est aussi écrit dans JOBS_FOLDER
+# pour que n'importe quel processus puisse répondre.
+
+jobs = {}
+jobs_lock = threading.Lock()
+# Réveille les flux d'événements à chaque changement d'un job (compteur 'updates')
+jobs_changed = threading.Condition(jobs_lock)
+# Uploads sur disque des fichiers en attente ou en cours: le balayage les rafraîchit
+pending_uploads = set()
+_executors = {}
+_executor_lock = threading.Lock()
+_progress_source = None
+
+def _drain_progress(queue):
+    """Reporte dans les jobs l'avancement envoyé par les workers"""
+    while True:
+        (job_id, index), percent = queue.get()
+        with jobs_lock:
+            job = jobs.get(job_id)
+            if job is not None and job['results'][index] is None:
+                job['progress'][index] = percent
+                _job_updated(job)
+                if time.time() - job['published'] >= 1:
+                    _save_job(job)
+
+def get_executor(lane='image'):
+    """Retourne le pool de workers d'une voie, créé au premier usage"""
+    global _progress_source
+    with _executor_lock:
+        if lane not in _executors:
+            context = multiprocessing.get_context('spawn')
+            if _progress_source is None:
+                _progress_source = context.Queue()
+                threading.Thread(target=_drain_progress, args=(_progress_source,), daemon=True).start()
+            _executors[lane] = ProcessPoolExecutor(
+                max_workers=lanes[lane].workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(_progress_source, 0 if lane == 'image' else BACKGROUND_NICE)
+            )
+        return _executors[lane]
+
+def _reset_executor(broken):
+    """Abandonne un pool cassé (worker tué, OOM...) pour en recréer un au prochain fichier"""
+    with _executor_lock:
+        for lane in [lane for lane, executor in _executors.items() if executor is broken]:
+            del _executors[lane]
+    broken.shutdown(wait=False, cancel_futures=True)
+
+class Lane:
+    """Voie d'un type de média: son pool de workers et une file par client, servies à tour de rôle"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.running = 0
+        self.backlog = 0.0  # coût des fichiers en attente (Mpx)
+        self.queues = OrderedDict()  # client -> deque de (coût, tâche)
+
+    def push(self, client, cost, task):
+        self.queues.setdefault(client, deque()).append((cost, task))
+        self.backlog += cost
+
+    def take_ready(self):
+        """Retire les tâches à démarrer: une par client à tour de rôle, tant qu'un worker est libre"""
+        ready = []
+        while self.queues and self.running < self.workers:
+            client, queue = next(iter(self.queues.items()))
+            cost, task = queue.popleft()
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            self.backlog -= cost
+            self.running += 1
+            ready.append(task)
+        return ready
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'queued': sum(len(queue) for queue in self.queues.values()),
+            'clients': len(self.queues),
+            'backlog_mpx': round(self.backlog, 1)
+        }
+
+lanes = {name: Lane(name, workers) for name, workers in
+         (('image', MAX_WORKERS), ('gif', GIF_WORKERS), ('video', VIDEO_WORKERS))}
+scheduler_lock = threading.Lock()
+# Réveille drain_executor quand une voie se vide
+scheduler_idle = threading.Condition(scheduler_lock)
+
+def media_lane(filename):
+    """Voie d'un fichier d'après son extension"""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.gif':
+        return 'gif'
+    return 'video' if ext in VIDEO_EXTENSIONS else 'image'
+
+def estimate_cost(source, filename):
+    """Coût d'un fichier en mégapixels traités: pixels × images (durée × fps pour une vidéo)
+
+    Lu dans l'en-tête, ffprobe pour les vidéos; un fichier illisible compte pour 1,
+    le worker remontera l'erreur.
+    """
+    try:
+        if media_lane(filename) == 'video':
+            probe = probe_video(source)
+            video = next(s for s in probe['streams'] if s.get('codec_type') == 'video')
+            frames = int(video.get('nb_frames') or 0)
+            if not frames:
+                num, _, den = video.get('avg_frame_rate', '').partition('/')
+                fps = float(num) / float(den) if num and den and float(den) else 30
+                frames = (media_duration(probe) or 0) * fps
+            return max(1.0, video['width'] * video['height'] * frames / 1e6)
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+            return max(1.0, img.width * img.height * getattr(img, 'n_frames', 1) / 1e6)
+    except Exception:
+        return 1.0
+
+def schedule(lane_name, client, cost, args, callback):
+    """Met une compression dans la file de sa voie puis démarre ce qui peut l'être
+
+    callback(executor, future) est appelé à la fin de la compression.
+    """
+    lane = lanes[lane_name]
+    with scheduler_lock:
+        lane.push(client, cost, (args, callback))
+    _dispatch(lane)
+
+def _dispatch(lane):
+    """Soumet au pool de la voie les tâches en attente, tant qu'il a des workers libres"""
+    while True:
+        with scheduler_lock:
+            ready = lane.take_ready()
+        if not ready:
+            return
+        for args, callback in ready:
+            executor = get_executor(lane.name)
+            try:
+                try:
+                    future = executor.submit(*args)
+                except BrokenProcessPool:
+                    _reset_executor(executor)
+                    executor = get_executor(lane.name)
+                    future = executor.submit(*args)
+            except Exception as e:
+                # Pool arrêté ou recréé sans succès: le fichier échoue, la file continue
+                future = Future()
+                future.set_exception(e)
+                _task_done(lane, callback, executor, future, dispatch=False)
+                continue
+            future.add_done_callback(
+                lambda f, executor=executor, callback=callback: _task_done(lane, callback, executor, f))
+
+def _task_done(lane, callback, executor, future, dispatch=True):
+    """Fin d'une tâche: résultat au job, worker libéré pour la suivante"""
+    try:
+        callback(executor, future)
+    finally:
+        with scheduler_lock:
+            lane.running -= 1
+            scheduler_idle.notify_all()
+        if dispatch:
+            _dispatch(lane)
+
+def job_stats(results):
+    """Calcule les statistiques agrégées d'un job"""
+    done = [r for r in results if r and r.get('success')]
+    total_reduction = sum(r['reduction'] for r in done)
+    return {
+        'totalSaved': sum(r['saved'] for r in done),
+        'avgReduction': round(total_reduction / len(done)) if done else 0,
+        'processed': len(done)
+    }
+
+def job_snapshot(job):
+    """Représentation JSON d'un job (à appeler sous jobs_lock)"""
+    return {
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'total': len(job['results']),
+        'completed': job['completed'],
+        'progress': list(job['progress']),
+        'results': list(job['results']),
+        'order': list(job['order']),
+        'stats': job_stats(job['results'])
+    }
+
+def _job_path(job_id):
+    """Fichier où l'état d'un job est publié"""
+    return os.path.join(JOBS_FOLDER, f'{job_id}.json')
+
+def _save_job(job):
+    """Publie l'état du job pour les autres processus serveur (à appeler sous jobs_lock)"""
+    job['published'] = time.time()
+    if WEB_WORKERS < 2:
+        return
+    path = _job_path(job['id'])
+    with open(path + '.tmp', 'w') as f:
+        json.dump(job_snapshot(job), f)
+    os.replace(path + '.tmp', path)
+
+def _job_updated(job):
+    """Signale un changement du job aux flux d'événements (à appeler sous jobs_lock)"""
+    job['updates'] += 1
+    jobs_changed.notify_all()
+
+def find_job(job_id):
+    """Retourne l'état JSON d'un job, tenu par ce processus ou publié par un autre"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is not None:
+            return job_snapshot(job)
+    if WEB_WORKERS < 2 or not is_job_id(job_id):
+        return None
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _prune_jobs():
+    """Oublie les jobs terminés depuis plus de JOB_RETENTION secondes"""
+    limit = time.time() - JOB_RETENTION
+    with jobs_lock:
+        for job_id in [j['id'] for j in jobs.values() if j['finished'] and j['finished'] < limit]:
+            del jobs[job_id]
+            try:
+                os.remove(_job_path(job_id))
+            except OSError:
+                pass
+
+def drain_executor():
+    """Attend la fin des compressions en file et en cours puis arrête les pools (arrêt propre)"""
+    with scheduler_lock:
+        scheduler_idle.wait_for(lambda: all(not lane.queues and not lane.running for lane in lanes.values()))
+    with _executor_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+def _set_result(job_id, index, result):
+    """Enregistre le résultat d'un fichier dans son job"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return
+        job['results'][index] = result
+        job['progress'][index] = 100
+        job['order'].append(index)
+        job['completed'] += 1
+        if job['completed'] == len(job['results']):
+            job['status'] = 'done'
+            job['finished'] = time.time()
+        else:
+            job['status'] = 'running'
+        _job_updated(job)
+        _save_job(job)
+
+def record_result(result, entry, compression_level, started=None, timings=None):
+    """Reporte le résultat d'un fichier dans les métriques"""
+    labels = metric_labels(entry['filename'], compression_level)
+    for name, seconds in (timings or {}).items():
+        observe('compressor_stage_seconds', seconds, stage=name, **labels)
+    if started is not None:
+        observe('compressor_file_seconds', time.perf_counter() - started, **labels)
+    if result.get('rejected'):
+        outcome = 'rejected'
+    elif not result.get('success'):
+        outcome = 'failed'
+    elif result.get('cached'):
+        outcome = 'cached'
+    elif result.get('passthrough'):
+        outcome = 'passthrough'
+    else:
+        outcome = 'compressed'
+    count('compressor_files_total', result=outcome, **labels)
+    count('compressor_bytes_in_total', entry['size'], **labels)
+    if result.get('success'):
+        count('compressor_bytes_out_total', result['compressed_size'], **labels)
+    if result.get('metadata_saved'):
+        count('compressor_metadata_bytes_saved_total', result['metadata_saved'], **labels)
+
+def _finish_file(job_id, index, entry, compression_level, started, executor, future):
+    """Récupère le résultat d'un worker, l'ajoute au cache, au job et aux métriques"""
+    filename = entry['filename']
+    set_gauge('compressor_queue_depth', -1)
+    release_ingest_memory(entry.pop('memory', 0))
+    with jobs_lock:
+        pending_uploads.discard(entry['source'])
+    timings = None
+    try:
+        result = future.result()
+        timings = result.pop('timings', None)
+        if result['success'] and entry['key']:
+            try:
+                cache_store(entry['key'], output_file(result['download_url']),
+                            {k: v for k, v in result.items() if k not in BASE_RESULT_KEYS})
+            except OSError as e:
+                # Cache indisponible (disque plein, droits): le fichier reste compressé
+                app.logger.warning("Mise en cache impossible pour %s: %s", filename, e)
+        if result['success'] and entry.get('quality_key') and result.get('quality'):
+            store_quality(entry['quality_key'], result['quality'])
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            _reset_executor(executor)
+        result = {'success': False, 'original_name': filename, 'error': str(e) or type(e).__name__}
+        # Worker mort avant d'avoir nettoyé son upload
+        if not isinstance(entry['source'], bytes):
+            remove_quietly(entry['source'])
+    if not result['success']:
+        app.logger.warning("Échec de %s: %s", filename, result.get('error'))
+    record_result(result, entry, compression_level, started, timings)
+    _set_result(job_id, index, result)
+
+def submit_job(entries, compression_level, settings, max_dimension=None, client=None):
+    """Crée un job: sert les fichiers en cache et met les autres dans la file de leur voie
+
+    entries: liste de dicts {'source', 'filename', 'size', 'key', 'quality_key', 'cached_path',
+    'lane', 'cost', 'memory'} (memory: réservation du budget d'ingestion; key=None: pas de cache de résultat; cached_path: sortie déjà trouvée en
+    cache par upload_entry), ou avec 'error' pour un fichier refusé à la réception
+    """
+    _prune_jobs()
+    start_sweeper()
+    job_id = uuid.uuid4().hex
+    output_dir = os.path.join(OUTPUT_FOLDER, job_id)
+    with jobs_lock:
+        jobs[job_id] = {
+            'id': job_id,
+            'status': 'queued',
+            'created': time.time(),
+            'finished': None,
+            'published': 0,
+            'updates': 0,
+            'completed': 0,
+            'progress': [0] * len(entries),
+            'results': [None] * len(entries),
+            'order': []  # index des fichiers dans l'ordre où ils se terminent
+        }
+        _save_job(jobs[job_id])
+    # Créé après l'enregistrement du job: le balayage ne touche pas aux jobs en cours
+    os.makedirs(output_dir)
+    for index, entry in enumerate(entries):
+        if 'error' in entry:
+            result = {'success': False, 'rejected': True, 'original_name': entry['filename'], 'error': entry['error']}
+            record_result(result, entry, compression_level)
+            _set_result(job_id, index, result)
+            continue
+        started = time.perf_counter()
+        if 'cached_path' in entry:
+            cached_path = entry['cached_path']
+        else:
+            cached_path = cache_lookup(entry['key']) if entry['key'] else None
+        if cached_path:
+            try:
+                result = serve_cached(cached_path, entry['source'], entry['filename'], compression_level,
+                                      entry['size'], settings.get('output_format') == 'auto', output_dir)
+                release_ingest_memory(entry.pop('memory', 0))
+                record_result(result, entry, compression_level, started)
+                _set_result(job_id, index, result)
+                continue
+            except OSError:
+                pass  # entrée évincée entre-temps: on recompresse
+        if 'cost' not in entry:
+            # Vu en cache par upload_entry, donc ni estimé ni débité par reserve
+            entry.update(lane=media_lane(entry['filename']), cost=estimate_cost(entry['source'], entry['filename']))
+            if client is not None:
+                charge(client, entry['cost'])
+        
+        file_settings = settings
+        quality = cached_quality(entry['quality_key']) if entry.get('quality_key') else None
+        if quality is not None:
+            file_settings = dict(settings, quality=quality, searched=True)
+        
+        if not isinstance(entry['source'], bytes):
+            with jobs_lock:
+                pending_uploads.add(entry['source'])
+        args = (process_file, entry['source'], entry['filename'],
+                compression_level, file_settings, max_dimension, (job_id, index), output_dir)
+        set_gauge('compressor_queue_depth', 1)
+        schedule(
+            entry['lane'], client, entry['cost'], args,
+            lambda executor, f, index=index, entry=entry, started=started:
+                _finish_file(job_id, index, entry, compression_level, started, executor, f)
+        )
+    return job_id
+
+def parse_job_form(form):
+    """Lit les paramètres de compression d'un formulaire (/compress, /uploads/<id>/complete)
+
+    Retourne (niveau, settings, max_dimension, variantes); lève ValueError si un
+    paramètre est invalide.
+    """
+    compression_level = form.get('compressionLevel', 'balanced')
+    settings = get_compression_settings(compression_level, form.get('quality', 85), form.get('targetSsim'))
+    if form.get('outputFormat') == 'auto':
+        settings = dict(settings, output_format='auto')
+    metadata = form.get('metadata') or METADATA_POLICY
+    if metadata not in METADATA_POLICIES:
+        raise ValueError(f"Politique de métadonnées inconnue: {metadata} (strip ou keep)")
+    settings = dict(settings, metadata=metadata)
+    resize_tier = form.get('resizeTier')
+    if resize_tier:
+        if resize_tier not in RESIZE_TIERS:
+            raise ValueError(f"Niveau de redimensionnement inconnu: {resize_tier} ({', '.join(RESIZE_TIERS)})")
+        settings = dict(settings, resize=resize_tier)
+    variants = parse_variants(form.get('variantSizes'), form.get('variantFormats'))
+    if variants:
+        settings = dict(settings, variants=variants)
+    return compression_level, settings, form.get('maxDimension') or None, variants
+
+def upload_entry(source, filename, size, digest, compression_level, settings, max_dimension, variants):
+    """Entrée de job pour un fichier reçu, avec sa voie et son coût (voir submit_job)
+
+    Le cache est consulté d'abord: un fichier déjà compressé est resservi sans worker,
+    il n'a ni voie ni coût et n'est pas débité par reserve.
+    """
+    # Variantes: plusieurs sorties par fichier, hors du cache de résultats
+    key = None if variants else cache_key(digest, filename, compression_level, settings, max_dimension)
+    entry = {
+        'source': source,
+        'filename': filename,
+        'size': size,
+        'key': key,
+        'cached_path': cache_lookup(key) if key else None,
+        'quality_key': quality_cache_key(digest, settings, variants['sizes'][0] if variants else max_dimension,
+                                         search_encoder(filename, compression_level, settings))
+    }
+    if not entry['cached_path']:
+        entry.update(lane=media_lane(filename), cost=estimate_cost(source, filename))
+    return entry
 
 @app.route('/compress', methods=['POST'])
 def compress_files():
+    entries = []
+    submitted = False
+    # Client à découvert: refusé avant la lecture du corps
+    client = client_id()
+    delay = admission_delay(client)
+    if delay:
+        return too_busy(delay, 'rate')
     try:
         if 'files' not in request.files:
             return jsonify({'success': False, 'error': 'Aucun fichier'}), 400
@@ -527,103 +2989,760 @@ def compress_files():
         if not files or files[0].filename == '':
             return jsonify({'success': False, 'error': 'Aucun fichier sélectionné'}), 400
         
-        compression_level = request.form.get('compressionLevel', 'balanced')
-        quality = request.form.get('quality', 85)
-        max_dimension = request.form.get('maxDimension') or None
+        try:
+            compression_level, settings, max_dimension, variants = parse_job_form(request.form)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        settings = get_compression_settings(compression_level, quality)
-        
-        results = []
-        total_saved = 0
-        total_reduction = 0
-        processed = 0
-        
-        for file in files:
+        # Lire les uploads (préfixe unique: deux fichiers homonymes d'un même lot
+        # ne doivent pas s'écraser pendant qu'ils sont traités en parallèle)
+        batch = uuid.uuid4().hex[:8]
+        names = set()
+        for index, file in enumerate(files):
+            # Type réel d'après les premiers octets, déjà détecté à la réception (UploadSpool):
+            # un fichier non pris en charge est refusé sans avoir été stocké, un fichier mal
+            # nommé est renommé
+            filename = secure_filename(file.filename)
+            head = file.stream.read(SNIFF_BYTES)
             try:
-                filename = secure_filename(file.filename)
-                input_path = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(input_path)
-                
-                original_size = os.path.getsize(input_path)
-                ext = os.path.splitext(filename)[1].lower()
-                
-                # Déterminer le format de sortie
-                if ext in ['.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff']:
-                    if ext == '.png' and compression_level != 'lossless':
-                        output_ext = '.webp'
-                    else:
-                        output_ext = ext
-                    output_name = filename.rsplit('.', 1)[0] + output_ext
-                    output_path = os.path.join(OUTPUT_FOLDER, output_name)
-                    
-                    smart_compress_image(input_path, output_path, settings, max_dimension)
-                    
-                elif ext in ['.mp4', '.mov', '.avi', '.webm', '.mkv']:
-                    output_name = filename.rsplit('.', 1)[0] + '_compressed.mp4'
-                    output_path = os.path.join(OUTPUT_FOLDER, output_name)
-                    
-                    if not compress_video(input_path, output_path, compression_level, max_dimension):
-                        raise Exception("Échec compression vidéo")
-                    
-                elif ext == '.gif':
-                    output_name = filename
-                    output_path = os.path.join(OUTPUT_FOLDER, output_name)
-                    
-                    if not compress_gif(input_path, output_path, compression_level, max_dimension):
-                        raise Exception("Échec compression GIF")
-                
-                else:
-                    raise Exception(f"Format non supporté: {ext}")
-                
-                compressed_size = os.path.getsize(output_path)
-                reduction = round((1 - compressed_size/original_size) * 100)
-                saved = original_size - compressed_size
-                
-                results.append({
-                    'success': True,
-                    'original_name': filename,
-                    'output_format': output_ext if 'output_ext' in locals() else ext,
-                    'original_size': original_size,
-                    'compressed_size': compressed_size,
-                    'reduction': reduction,
-                    'saved': saved,
-                    'download_url': f'/download/{os.path.basename(output_path)}'
-                })
-                
-                total_saved += saved
-                total_reduction += reduction
-                processed += 1
-                
-                # Cleanup
-                os.remove(input_path)
-                
-            except Exception as e:
-                results.append({
-                    'success': False,
-                    'original_name': file.filename,
-                    'error': str(e)
-                })
+                filename = sniffed_filename(filename, head)
+            except ValueError as e:
+                entries.append({'source': b'', 'filename': filename or file.filename, 'size': 0,
+                                'key': None, 'error': str(e)})
+                continue
+            filename = unique_filename(filename, names)
+            input_path = os.path.join(UPLOAD_FOLDER, f'{batch}_{index}_{filename}')
+            started = time.perf_counter()
+            source, size, digest, reserved = ingest_upload(file, input_path, keep_in_memory(filename), head)
+            observe('compressor_stage_seconds', time.perf_counter() - started, stage='save',
+                    **metric_labels(filename, compression_level))
+            entries.append(dict(upload_entry(source, filename, size, digest, compression_level,
+                                             settings, max_dimension, variants), memory=reserved))
         
-        avg_reduction = round(total_reduction / processed) if processed > 0 else 0
+        delay = reserve(client, entries)
+        if delay:
+            return too_busy(delay, 'overload')
+        submitted = True
+        job_id = submit_job(entries, compression_level, settings, max_dimension, client)
         
         return jsonify({
             'success': True,
-            'results': results,
-            'stats': {
-                'totalSaved': total_saved,
-                'avgReduction': avg_reduction,
-                'processed': processed
-            }
-        })
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}'
+        }), 202
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        # Échec avant la soumission (413, upload coupé...): les fichiers déjà lus ne seront
+        # jamais traités
+        if not submitted:
+            for entry in entries:
+                release_ingest_memory(entry.get('memory', 0))
+                if not isinstance(entry['source'], bytes):
+                    remove_quietly(entry['source'])
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'success': False, 'error': f'Envoi trop volumineux (max {MAX_UPLOAD_MB} Mo)'}), 413
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job introuvable'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/files/<int:index>')
+def job_file(job_id, index):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job introuvable'}), 404
+    if not 0 <= index < len(job['results']):
+        return jsonify({'success': False, 'error': 'Fichier introuvable'}), 404
+    result = job['results'][index]
+    if result is None:
+        return jsonify({'success': True, 'status': 'pending'}), 202
+    return jsonify(dict(result, status='done'))
+
+# --- Admission ---------------------------------------------------------------
+# Seau de jetons par client, dans ce processus serveur (avec WEB_WORKERS processus, un
+# client peut en obtenir jusqu'à WEB_WORKERS fois le débit). Le coût d'une requête n'est
+# connu qu'après la lecture des fichiers: il est débité après coup, et un client à
+# découvert est refusé dès sa requête suivante, avant l'envoi du corps.
+
+admission_lock = threading.Lock()
+_buckets = {}  # client -> (jetons, instant de la dernière mise à jour); absent = seau plein
+
+def client_id():
+    """Identifiant du client pour l'admission: son adresse IP"""
+    return request.remote_addr or 'inconnu'
+
+def _refill(client, now):
+    """Jetons du client à l'instant now (à appeler sous admission_lock)"""
+    tokens, updated = _buckets.get(client, (ADMISSION_BURST, now))
+    return min(ADMISSION_BURST, tokens + (now - updated) * ADMISSION_RATE)
+
+def admission_delay(client):
+    """Secondes à attendre avant que le client soit à nouveau admis (0: admis)"""
+    now = time.monotonic()
+    with admission_lock:
+        tokens = _refill(client, now)
+        if tokens >= ADMISSION_BURST:
+            _buckets.pop(client, None)
+    return 0 if tokens >= 0 else -tokens / ADMISSION_RATE
+
+def reserve(client, entries):
+    """Admet les fichiers d'une requête et débite le client de leur coût
+
+    Retourne 0, ou le délai à annoncer si une voie a déjà trop de travail en attente
+    (une voie vide accepte toujours un fichier, même plus gros que LANE_MAX_BACKLOG).
+    """
+    costs = {}
+    for entry in entries:
+        if 'cost' in entry:
+            costs[entry['lane']] = costs.get(entry['lane'], 0) + entry['cost']
+    with scheduler_lock:
+        for name, cost in costs.items():
+            backlog = lanes[name].backlog
+            if backlog and backlog + cost > LANE_MAX_BACKLOG:
+                return OVERLOAD_RETRY_AFTER
+    charge(client, sum(costs.values()))
+    return 0
+
+def charge(client, cost):
+    """Débite le seau du client du coût d'un travail admis"""
+    now = time.monotonic()
+    with admission_lock:
+        _buckets[client] = (_refill(client, now) - cost, now)
+
+def too_busy(delay, reason):
+    """Réponse HTTP 429 avec Retry-After"""
+    count('compressor_admission_rejected_total', reason=reason)
+    seconds = max(1, math.ceil(delay))
+    response = jsonify({'success': False, 'error': f'Trop de travail en attente, réessayez dans {seconds} s',
+                        'retry_after': seconds})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+# --- Uploads reprenables -----------------------------------------------------
+# Pour les gros fichiers sur des connexions instables: le client crée un envoi
+# (POST /uploads), pousse des morceaux à un offset donné (PUT, ajoutés directement au
+# fichier sous RESUMABLE_FOLDER), retrouve l'offset reçu après une coupure (HEAD) puis
+# finalise avec l'empreinte SHA-256 du fichier, ce qui crée le job. L'offset est la
+# taille du fichier partiel: l'état survit à un redémarrage et se partage entre
+# processus serveur.
+
+uploads_lock = threading.Lock()
+_uploads_busy = set()
+
+def _upload_paths(upload_id):
+    """Fichiers d'un envoi: description JSON et contenu reçu"""
+    base = os.path.join(RESUMABLE_FOLDER, upload_id)
+    return base + '.json', base + '.part'
+
+def load_upload(upload_id):
+    """Description d'un envoi (None s'il n'existe pas)"""
+    if not is_job_id(upload_id):
+        return None
+    try:
+        with open(_upload_paths(upload_id)[0]) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def remove_upload(upload_id):
+    """Supprime un envoi et son contenu"""
+    for path in _upload_paths(upload_id):
+        remove_quietly(path)
+
+@contextmanager
+def claim_upload(upload_id):
+    """Réserve un envoi pendant une écriture ou sa finalisation; False s'il est déjà pris
+
+    Deux écritures simultanées sur le même envoi depuis deux processus serveur ne sont
+    pas détectées ici: l'empreinte vérifiée à la finalisation les refuse.
+    """
+    with uploads_lock:
+        claimed = upload_id not in _uploads_busy
+        _uploads_busy.add(upload_id)
+    try:
+        yield claimed
+    finally:
+        if claimed:
+            with uploads_lock:
+                _uploads_busy.discard(upload_id)
+
+def upload_state(upload, offset, status=200, error=None):
+    """Réponse décrivant l'avancement d'un envoi (offset aussi en en-tête, pour HEAD)"""
+    state = {
+        'success': error is None,
+        'upload_id': upload['id'],
+        'filename': upload['filename'],
+        'size': upload['size'],
+        'offset': offset,
+        'upload_url': f"/uploads/{upload['id']}"
+    }
+    if error is not None:
+        state['error'] = error
+    response = jsonify(state)
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(offset)
+    response.headers['Upload-Length'] = str(upload['size'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    filename = secure_filename(request.form.get('filename', ''))
+    try:
+        size = int(request.form.get('size', ''))
+    except ValueError:
+        size = 0
+    if not filename or size <= 0:
+        return jsonify({'success': False, 'error': 'Nom (filename) et taille (size) du fichier requis'}), 400
+    if size > RESUMABLE_MAX_BYTES:
+        return jsonify({'success': False, 'error': f'Fichier trop volumineux (max {RESUMABLE_MAX_BYTES // (1024 * 1024)} Mo)'}), 413
+    delay = admission_delay(client_id())
+    if delay:
+        return too_busy(delay, 'rate')
+    start_sweeper()
+    upload = {'id': uuid.uuid4().hex, 'filename': filename, 'size': size, 'created': time.time()}
+    meta_path, part_path = _upload_paths(upload['id'])
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump(upload, f)
+    return upload_state(upload, 0, 201)
+
+@app.route('/uploads/<upload_id>')
+def upload_status(upload_id):
+    # Aussi servi en HEAD: l'offset est dans l'en-tête Upload-Offset
+    upload = load_upload(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'error': 'Envoi introuvable'}), 404
+    return upload_state(upload, os.path.getsize(_upload_paths(upload_id)[1]))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Ajoute le corps de la requête à l'envoi, à l'offset indiqué (en-tête Upload-Offset)
+
+    Un morceau coupé en route garde ce qui a été reçu: le client reprend à l'offset
+    renvoyé par HEAD.
+    """
+    upload = load_upload(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'error': 'Envoi introuvable'}), 404
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'En-tête Upload-Offset requis'}), 400
+    with claim_upload(upload_id) as claimed:
+        if not claimed:
+            return jsonify({'success': False, 'error': 'Envoi déjà en cours pour ce fichier'}), 409
+        part_path = _upload_paths(upload_id)[1]
+        with open(part_path, 'ab') as out:
+            received = out.tell()
+            if offset != received:
+                return upload_state(upload, received, 409, f"Offset {offset} inattendu, reprendre à {received}")
+            if offset + (request.content_length or 0) > upload['size']:
+                return upload_state(upload, received, 413, f"Le morceau dépasse la taille annoncée ({upload['size']} octets)")
+            while chunk := request.stream.read(CHUNK_SIZE):
+                if received + len(chunk) > upload['size']:
+                    out.write(chunk[:upload['size'] - received])
+                    received = upload['size']
+                    break
+                out.write(chunk)
+                received += len(chunk)
+        return upload_state(upload, received)
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    if load_upload(upload_id) is None:
+        return jsonify({'success': False, 'error': 'Envoi introuvable'}), 404
+    with claim_upload(upload_id) as claimed:
+        if not claimed:
+            return jsonify({'success': False, 'error': 'Envoi en cours pour ce fichier'}), 409
+        remove_upload(upload_id)
+    return jsonify({'success': True})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Vérifie l'empreinte du fichier reçu et le soumet comme un job d'un fichier
+
+    Le fichier est déplacé tel quel dans UPLOAD_FOLDER (pas de recopie): la compression
+    démarre dès la réponse. Les paramètres sont ceux de /compress, plus sha256.
+    """
+    upload = load_upload(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'error': 'Envoi introuvable'}), 404
+    expected = request.form.get('sha256', '').strip().lower()
+    if not expected:
+        return jsonify({'success': False, 'error': 'Empreinte SHA-256 (sha256) requise'}), 400
+    try:
+        compression_level, settings, max_dimension, variants = parse_job_form(request.form)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    with claim_upload(upload_id) as claimed:
+        if not claimed:
+            return jsonify({'success': False, 'error': 'Envoi en cours pour ce fichier'}), 409
+        part_path = _upload_paths(upload_id)[1]
+        size = os.path.getsize(part_path)
+        if size != upload['size']:
+            return upload_state(upload, size, 409, f"Envoi incomplet ({size}/{upload['size']} octets)")
+        started = time.perf_counter()
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+            digest.update(head)
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+        if digest.hexdigest() != expected:
+            remove_upload(upload_id)
+            return jsonify({'success': False, 'error': 'Empreinte SHA-256 différente: fichier corrompu, à renvoyer'}), 422
+        try:
+            filename = sniffed_filename(upload['filename'], head)
+        except ValueError as e:
+            remove_upload(upload_id)
+            entry = {'source': b'', 'filename': upload['filename'], 'size': 0, 'key': None, 'error': str(e)}
+        else:
+            entry = upload_entry(part_path, filename, size, digest.hexdigest(),
+                                 compression_level, settings, max_dimension, variants)
+            # Refusé: l'envoi est conservé, le client finalise à nouveau plus tard
+            delay = reserve(client_id(), [entry])
+            if delay:
+                return too_busy(delay, 'overload')
+            entry['source'] = os.path.join(UPLOAD_FOLDER, f'{upload_id[:8]}_0_{filename}')
+            os.replace(part_path, entry['source'])
+            remove_upload(upload_id)
+            observe('compressor_stage_seconds', time.perf_counter() - started, stage='save',
+                    **metric_labels(filename, compression_level))
+    try:
+        job_id = submit_job([entry], compression_level, settings, max_dimension, client_id())
     except Exception as e:
+        if 'error' not in entry:
+            remove_quietly(entry['source'])
         return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/jobs/{job_id}'
+    }), 202
+
+# --- Événements (SSE) ---------------------------------------------------------
+# /jobs/<id>/events pousse l'avancement d'un job en Server-Sent Events: chaque
+# résultat part dès que son fichier est terminé, sans attendre le reste du lot.
+# Le flux occupe un thread gthread: il se ferme après EVENTS_MAX_SECONDS et le
+# navigateur le rouvre avec Last-Event-ID; au-delà de MAX_STREAMS flux ouverts, la
+# requête reçoit 503 et l'interface revient au polling. Un job tenu par un autre
+# processus serveur est suivi en relisant son état publié.
+
+EVENTS_POLL_SECONDS = 0.5
+EVENTS_RETRY_MS = 2000
+
+streams_lock = threading.Lock()
+_open_streams = 0
+
+def _close_stream():
+    global _open_streams
+    with streams_lock:
+        _open_streams -= 1
+
+def long_stream(generator, mimetype, headers=None):
+    """Réponse en flux comptée dans MAX_STREAMS (503 avec Retry-After au-delà)"""
+    global _open_streams
+    with streams_lock:
+        if _open_streams >= MAX_STREAMS:
+            generator.close()
+            seconds = max(1, EVENTS_RETRY_MS // 1000)
+            response = jsonify({'success': False, 'error': f'Trop de flux ouverts, réessayez dans {seconds} s',
+                                'retry_after': seconds})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(seconds)
+            return response
+        _open_streams += 1
+    response = Response(stream_with_context(generator), mimetype=mimetype, headers=headers)
+    response.call_on_close(_close_stream)
+    return response
+
+def job_version(job_id):
+    """Compteur de changements d'un job tenu par ce processus (None sinon)"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return None if job is None else job['updates']
+
+def wait_job_update(job_id, version, timeout):
+    """Attend un changement du job après `version`; False si rien n'a bougé"""
+    if version is None:
+        time.sleep(min(timeout, EVENTS_POLL_SECONDS))
+        return True
+    with jobs_changed:
+        return jobs_changed.wait_for(
+            lambda: job_id not in jobs or jobs[job_id]['updates'] != version, timeout)
+
+def sse_event(name, data, event_id=None):
+    """Formate un événement SSE"""
+    prefix = '' if event_id is None else f'id: {event_id}\n'
+    return f'{prefix}event: {name}\ndata: {json.dumps(data)}\n\n'
+
+def stream_job_events(job_id, sent=0):
+    """Génère les événements d'un job: job, progress, result puis done
+
+    Les résultats partent dans l'ordre où les fichiers se terminent, le n-ième avec
+    l'id n: après une reconnexion (Last-Event-ID), les `sent` premiers sont déjà connus
+    du client. Le flux se ferme après EVENTS_MAX_SECONDS pour libérer son thread.
+    """
+    progress = {}
+    chunk = [f'retry: {EVENTS_RETRY_MS}\n\n']
+    opened = last_sent = time.monotonic()
+    while True:
+        # Lu avant l'état: un changement survenu entre les deux réveille l'attente
+        version = job_version(job_id)
+        job = find_job(job_id)
+        if job is None:
+            yield sse_event('error', {'error': 'Job introuvable'})
+            return
+        if chunk:  # premier passage: annonce le job après la directive retry
+            chunk.append(sse_event('job', {'job_id': job_id, 'total': job['total']}))
+        for index in job['order'][sent:]:
+            sent += 1
+            chunk.append(sse_event('result', {'index': index, 'result': job['results'][index],
+                                              'completed': sent, 'total': job['total']}, sent))
+        for index, result in enumerate(job['results']):
+            if result is None and job['progress'][index] != progress.get(index, 0):
+                progress[index] = job['progress'][index]
+                chunk.append(sse_event('progress', {'index': index, 'percent': progress[index]}))
+        if job['status'] == 'done':
+            chunk.append(sse_event('done', {'stats': job['stats']}))
+            yield ''.join(chunk)
+            return
+        if time.monotonic() - opened >= EVENTS_MAX_SECONDS:
+            # Fin du flux: le navigateur le rouvre EVENTS_RETRY_MS plus tard avec Last-Event-ID
+            if chunk:
+                yield ''.join(chunk)
+            return
+        if chunk:
+            yield ''.join(chunk)
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= EVENTS_KEEPALIVE:
+            # Commentaire: garde la connexion ouverte à travers les proxys
+            yield ': keepalive\n\n'
+            last_sent = time.monotonic()
+        chunk = []
+        wait_job_update(job_id, version, EVENTS_KEEPALIVE)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    if find_job(job_id) is None:
+        return jsonify({'success': False, 'error': 'Job introuvable'}), 404
+    last_id = request.headers.get('Last-Event-ID', '')
+    sent = int(last_id) if last_id.isdigit() else 0
+    return long_stream(stream_job_events(job_id, sent), 'text/event-stream',
+                       {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Stockage des sorties --------------------------------------------------
+# Un dossier par job sous OUTPUT_FOLDER. Un thread de fond par processus serveur
+# supprime les jobs expirés puis les plus anciens au-delà du quota, sans jamais
+# toucher à un job en cours, et les uploads orphelins laissés par un arrêt brutal.
+
+STORAGE_FOLDERS = {CACHE_FOLDER, JOBS_FOLDER, METRICS_FOLDER}
+storage_stats = {'sweeps': 0, 'removed': 0, 'freed_bytes': 0, 'orphans': 0, 'bytes': 0, 'last_sweep': None}
+_sweeper_lock = threading.Lock()
+_sweeper = None
+
+def _tree_size(path):
+    """Taille d'un fichier ou d'un dossier (récursif)"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _remove_tree(path):
+    """Supprime un dossier de job ou un ancien fichier de sortie isolé"""
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        remove_quietly(path)
+
+def sweep_storage(now=None):
+    """Applique OUTPUT_TTL, OUTPUT_QUOTA_MB et UPLOAD_TTL; retourne le nombre d'entrées supprimées"""
+    now = now or time.time()
+    entries = []
+    for name in os.listdir(OUTPUT_FOLDER):
+        path = os.path.join(OUTPUT_FOLDER, name)
+        if path in STORAGE_FOLDERS:
+            continue
+        # Jobs en cours (ici ou dans un autre processus): jamais supprimés
+        if is_job_id(name) and (find_job(name) or {}).get('status', 'done') != 'done':
+            continue
+        try:
+            entries.append((os.path.getmtime(path), _tree_size(path), path))
+        except OSError:
+            continue  # supprimé entre-temps
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    removed = freed = 0
+    for mtime, size, path in entries:
+        if mtime >= now - OUTPUT_TTL and total <= OUTPUT_QUOTA_BYTES:
+            break
+        _remove_tree(path)
+        total -= size
+        removed += 1
+        freed += size
+    
+    # Uploads de fichiers en attente dans une voie ou en cours: rafraîchis à chaque
+    # balayage, pour qu'aucun processus ne les prenne pour des orphelins
+    with jobs_lock:
+        held = set(pending_uploads)
+    for path in held:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+    orphans = 0
+    for name in os.listdir(UPLOAD_FOLDER):
+        path = os.path.join(UPLOAD_FOLDER, name)
+        if path == RESUMABLE_FOLDER or path in held:
+            continue
+        try:
+            if os.path.getmtime(path) < now - UPLOAD_TTL:
+                os.remove(path)
+                orphans += 1
+        except OSError:
+            pass
+    # Uploads reprenables sans activité depuis RESUMABLE_TTL: abandonnés
+    for name in os.listdir(RESUMABLE_FOLDER):
+        upload_id, ext = os.path.splitext(name)
+        if ext != '.json':
+            continue
+        try:
+            mtime = max(os.path.getmtime(path) for path in _upload_paths(upload_id) if os.path.exists(path))
+        except (OSError, ValueError):
+            continue
+        if mtime < now - RESUMABLE_TTL:
+            with claim_upload(upload_id) as claimed:
+                if claimed:
+                    remove_upload(upload_id)
+                    orphans += 1
+    # États de jobs publiés par un processus arrêté avant de les oublier
+    for name in os.listdir(JOBS_FOLDER):
+        path = os.path.join(JOBS_FOLDER, name)
+        try:
+            if os.path.getmtime(path) < now - JOB_RETENTION - SWEEP_INTERVAL:
+                os.remove(path)
+        except OSError:
+            pass
+    
+    with _sweeper_lock:
+        storage_stats['sweeps'] += 1
+        storage_stats['removed'] += removed
+        storage_stats['freed_bytes'] += freed
+        storage_stats['orphans'] += orphans
+        storage_stats['bytes'] = total
+        storage_stats['last_sweep'] = now
+    if removed or orphans:
+        app.logger.info('Stockage: %d sortie(s) supprimée(s) (%d octets), %d upload(s) orphelin(s)',
+                        removed, freed, orphans)
+    return removed + orphans
+
+def _sweep_loop():
+    """Boucle du thread de nettoyage"""
+    while True:
+        try:
+            sweep_storage()
+        except Exception as e:
+            app.logger.error('Erreur de nettoyage du stockage: %s', e)
+        time.sleep(SWEEP_INTERVAL)
+
+def start_sweeper():
+    """Démarre le thread de nettoyage de ce processus (au premier job)"""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_loop, name='storage-sweeper', daemon=True)
+            _sweeper.start()
+
+# --- Archive ZIP -------------------------------------------------------------
+# Les sorties d'un job sont envoyées en un seul ZIP, produit en flux (transfert
+# chunked) au fur et à mesure que les fichiers se terminent: ni l'archive ni les
+# fichiers ne sont chargés entiers en mémoire ou recopiés sur disque.
+
+# Formats déjà compressés: stockés tels quels, les recompresser ne gagnerait rien
+ARCHIVE_STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.avif', '.gif',
+                             '.mp4', '.mov', '.avi', '.webm', '.mkv'}
+ARCHIVE_POLL_SECONDS = 0.5
+
+class _ArchiveSink(io.RawIOBase):
+    """Flux d'écriture non seekable: zipfile y écrit, le générateur vide le tampon"""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def take(self):
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return data
+
+def stream_archive(job_id):
+    """Génère le ZIP des sorties d'un job, fichier par fichier dès qu'ils sont prêts"""
+    sink = _ArchiveSink()
+    names = set()
+    added = set()
+    errors = []
+    with zipfile.ZipFile(sink, 'w') as archive:
+        while True:
+            job = find_job(job_id)
+            if job is None:
+                break
+            for index, result in enumerate(job['results']):
+                if result is None or index in added:
+                    continue
+                added.add(index)
+                if not result.get('success'):
+                    errors.append(f"{result.get('original_name')}: {result.get('error')}")
+                    continue
+                path = output_file(result['download_url'])
+                # Noms uniques dans l'archive (deux sorties homonymes d'un même lot)
+                base, ext = os.path.splitext(os.path.basename(path))
+                name, n = base + ext, 1
+                while name in names:
+                    n += 1
+                    name = f'{base} ({n}){ext}'
+                names.add(name)
+                info = zipfile.ZipInfo(name, time.localtime(os.path.getmtime(path))[:6])
+                info.compress_type = zipfile.ZIP_STORED if ext.lower() in ARCHIVE_STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                info.file_size = os.path.getsize(path)
+                with open(path, 'rb') as src, archive.open(info, 'w') as dst:
+                    while chunk := src.read(CHUNK_SIZE):
+                        dst.write(chunk)
+                        if sink.buffer:  # un morceau vide terminerait la réponse chunked
+                            yield sink.take()
+                yield sink.take()
+            if job['status'] == 'done':
+                break
+            time.sleep(ARCHIVE_POLL_SECONDS)
+        if errors:
+            archive.writestr('erreurs.txt', '\n'.join(errors) + '\n')
+    yield sink.take()
+
+@app.route('/jobs/<job_id>/archive')
+def job_archive(job_id):
+    if find_job(job_id) is None:
+        return jsonify({'success': False, 'error': 'Job introuvable'}), 404
+    return long_stream(stream_archive(job_id), 'application/zip',
+                       {'Content-Disposition': f'attachment; filename="compression_{job_id[:8]}.zip"'})
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    init_storage()
+
+@app.after_request
+def server_timing(response):
+    """Ajoute l'en-tête Server-Timing (durée de la requête; import du module à la première)"""
+    global _startup_reported
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    timings = [f'app;dur={seconds * 1000:.1f}']
+    if not _startup_reported:
+        _startup_reported = True
+        timings.append(f'startup;dur={import_seconds * 1000:.1f};desc="import app.py"')
+    response.headers['Server-Timing'] = ', '.join(timings)
+    observe('compressor_request_seconds', seconds, route=request.endpoint or 'none')
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return render_metrics(collect_metrics()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/cache/stats')
+def cache_statistics():
+    with cache_lock:
+        stats = dict(cache_stats, entries=len(cache_index), max_bytes=CACHE_MAX_BYTES,
+                     process_max_bytes=CACHE_PROCESS_BYTES)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0
+    return jsonify(stats)
+
+@app.route('/storage/stats')
+def storage_statistics():
+    with _sweeper_lock:
+        stats = dict(storage_stats)
+    stats.update(ttl=OUTPUT_TTL, quota_bytes=OUTPUT_QUOTA_BYTES, upload_ttl=UPLOAD_TTL,
+                 sweep_interval=SWEEP_INTERVAL)
+    return jsonify(stats)
+
+@app.route('/scheduler/stats')
+def scheduler_statistics():
+    with scheduler_lock:
+        stats = {name: lane.stats() for name, lane in lanes.items()}
+    now = time.monotonic()
+    with admission_lock:
+        throttled = sum(1 for client in _buckets if _refill(client, now) < 0)
+    return jsonify({'lanes': stats, 'clients_tracked': len(_buckets), 'clients_throttled': throttled,
+                    'rate_mpx': ADMISSION_RATE, 'burst_mpx': ADMISSION_BURST, 'max_backlog_mpx': LANE_MAX_BACKLOG})
+
+@app.route('/download/<job_id>/<filename>')
+def download_job_file(job_id, filename):
+    if not is_job_id(job_id):
+        return jsonify({'success': False, 'error': 'Fichier introuvable'}), 404
+    return send_from_directory(os.path.join(OUTPUT_FOLDER, job_id), filename, as_attachment=True)
 
 @app.route('/download/<filename>')
 def download(filename):
-    return send_file(os.path.join(OUTPUT_FOLDER, filename), as_attachment=True)
+    # Anciennes sorties, écrites à la racine de OUTPUT_FOLDER
+    return send_from_directory(OUTPUT_FOLDER, filename, as_attachment=True)
+
+# Durée de l'import de ce module (démarrage à froid), remontée dans Server-Timing
+import_seconds = time.perf_counter() - _import_started
+_startup_reported = False
+
+def serve():
+    """Démarre le serveur choisi par SERVER ('dev' ou 'gunicorn')"""
+    init_storage(fresh=True)
+    if SERVER != 'gunicorn':
+        app.run(host='0.0.0.0', port=PORT, debug=DEBUG, threaded=True)
+        return
+    from gunicorn.app.base import BaseApplication
+
+    class GunicornServer(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'0.0.0.0:{PORT}',
+                'workers': WEB_WORKERS,
+                'worker_class': 'gthread',
+                'threads': WEB_THREADS,
+                'keepalive': KEEPALIVE,
+                'graceful_timeout': GRACEFUL_TIMEOUT,
+                # SIGTERM: le worker cesse d'accepter des requêtes et termine les compressions en cours
+                'worker_exit': lambda server, worker: drain_executor(),
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    GunicornServer().run()
 
 if __name__ == '__main__':
     print("🗜️ Smart Media Compressor Pro")
-    print("🌐 http://localhost:5000")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    print(f"🌐 http://localhost:{PORT}")
+    serve()
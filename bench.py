@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Benchmarks du compresseur
+Génère des médias synthétiques et mesure temps, mémoire et taille de sortie
+
+Usage:
+    python bench.py gif [--frames 50 200 500] [--size 480]
+    python bench.py suite [--quick] [--repeat 3] [--baseline bench.json] [--threshold 0.2]
+    python bench.py startup [--repeat 5] [--requests 50]
+    python bench.py resize [--targets 1080 800] [--width 4240] [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import subprocess
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFilter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import app
+
+
+def peak_rss_mb():
+    """Pic de mémoire résidente du processus courant (Mo), None si indisponible"""
+    # VmHWM repart de zéro à l'exec, contrairement à ru_maxrss hérité du processus parent
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sous macOS, en kilo-octets sous Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def make_gif(path, frames, size):
+    """Génère un GIF animé reproductible: dégradé fixe et formes en mouvement"""
+    width, height = size
+    background = Image.linear_gradient('L').resize(size).convert('RGB')
+    images = []
+    for i in range(frames):
+        frame = background.copy()
+        draw = ImageDraw.Draw(frame)
+        x = (i * 7) % width
+        draw.ellipse((x, height // 4, x + width // 6, height // 4 + width // 6), fill=(240, 180, (i * 5) % 256))
+        draw.rectangle((0, height - 20, (i * width) // frames, height), fill=(20, 120, 200))
+        images.append(frame)
+    images[0].save(path, save_all=True, append_images=images[1:], duration=40, loop=0)
+
+
+def legacy_compress_gif(input_path, output_path, compression_level, max_dimension=None):
+    """Ancien pipeline: palette adaptative par frame, toutes les frames en mémoire"""
+    with Image.open(input_path) as img:
+        colors = app.gif_colors(compression_level)
+        frames = []
+        for frame_num in range(img.n_frames):
+            img.seek(frame_num)
+            frame = img.convert('RGB')
+            if max_dimension:
+                new_size = app.fit_size(frame.size, int(max_dimension))
+                if new_size:
+                    frame = frame.resize(new_size, Image.Resampling.LANCZOS)
+            frames.append(frame.convert('P', palette=Image.ADAPTIVE, colors=colors))
+        frames[0].save(output_path, save_all=True, append_images=frames[1:], optimize=True, loop=0)
+    return True
+
+
+GIF_PIPELINES = {
+    'legacy': lambda src, dst, dim: legacy_compress_gif(src, dst, 'balanced', dim),
+    'stream': lambda src, dst, dim: app.compress_gif(src, dst, 'balanced', dim, shared_palette=False),
+    'stream_shared_palette': lambda src, dst, dim: app.compress_gif(src, dst, 'balanced', dim, shared_palette=True),
+}
+
+
+def _run_gif_case(pipeline, input_path, output_path, max_dimension, queue):
+    """Exécute un pipeline dans un processus neuf pour isoler le pic mémoire"""
+    start = time.perf_counter()
+    ok = GIF_PIPELINES[pipeline](input_path, output_path, max_dimension)
+    queue.put({
+        'ok': bool(ok),
+        'seconds': round(time.perf_counter() - start, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    })
+
+
+def run_isolated(target, *args):
+    """Lance target(*args, queue) dans un processus séparé et retourne son résultat"""
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def bench_gif(args):
+    """Compare l'ancien pipeline GIF et le moteur en flux selon le nombre de frames"""
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for frames in args.frames:
+            input_path = os.path.join(tmp, f'in_{frames}.gif')
+            make_gif(input_path, frames, (args.size, args.size * 3 // 4))
+            for pipeline in GIF_PIPELINES:
+                output_path = os.path.join(tmp, f'out_{frames}_{pipeline}.gif')
+                result = run_isolated(_run_gif_case, pipeline, input_path, output_path, args.max_dimension)
+                result.update({
+                    'pipeline': pipeline,
+                    'frames': frames,
+                    'input_bytes': os.path.getsize(input_path),
+                    'output_bytes': os.path.getsize(output_path) if result['ok'] else None,
+                })
+                rows.append(result)
+                print(f"{frames:>5} frames  {pipeline:<22} {result['seconds']:>7.3f}s  "
+                      f"{result['peak_rss_mb']} Mo  {result['output_bytes']} octets", file=sys.stderr)
+    return rows
+
+
+# --- Suite complète ------------------------------------------------------------
+# Corpus synthétique reproductible (mêmes graines, mêmes fichiers), un processus
+# neuf par pipeline pour isoler le pic mémoire, comparaison à une référence JSON.
+
+SUITE_CORPUS = {
+    'full': {
+        'photo': [(1224, 816), (2448, 1632), (4240, 2832)],  # ~1, 4 et 12 Mpx
+        'png_alpha': [(512, 512), (1024, 1024)],
+        'gif': [20, 100],                                     # nombre de frames
+        'video': [2, 5],                                      # secondes
+    },
+    'quick': {
+        'photo': [(816, 544), (1224, 816)],
+        'png_alpha': [(256, 256), (512, 512)],
+        'gif': [10, 30],
+        'video': [1, 2],
+    },
+}
+
+# Métrique: sens de l'amélioration (1 = plus haut est mieux, -1 = plus bas est mieux)
+REGRESSION_CHECKS = {'files_per_sec': 1, 'p95_seconds': -1, 'peak_rss_mb': -1, 'ratio': -1}
+
+
+def make_photo(path, size, seed):
+    """Génère une « photo » reproductible: dégradés, formes floues et grain"""
+    rng = np.random.RandomState(seed)
+    width, height = size
+    x = np.linspace(0, 1, width)[None, :, None]
+    y = np.linspace(0, 1, height)[:, None, None]
+    base = (rng.uniform(40, 200, 3) * (1 - x) + rng.uniform(40, 200, 3) * y) * np.ones((height, width, 3))
+    img = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        cx, cy = rng.randint(0, width), rng.randint(0, height)
+        r = rng.randint(width // 40, width // 6)
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=tuple(int(c) for c in rng.randint(0, 256, 3)))
+    img = img.filter(ImageFilter.GaussianBlur(width / 400))
+    grain = rng.normal(0, 6, (height, width, 3))
+    img = Image.fromarray(np.clip(np.asarray(img) + grain, 0, 255).astype(np.uint8))
+    img.save(path, 'JPEG', quality=92)
+
+
+def make_alpha_png(path, size, seed):
+    """Génère un PNG transparent reproductible: forme colorée à bord progressif"""
+    rng = np.random.RandomState(seed)
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width]
+    distance = np.hypot((xx - width / 2) / (width / 2), (yy - height / 2) / (height / 2))
+    alpha = np.clip((1 - distance) * 2, 0, 1) * 255
+    rgb = np.stack([xx * 255 // width, yy * 255 // height, np.full_like(xx, rng.randint(0, 256))], axis=-1)
+    rgba = np.dstack([rgb, alpha]).astype(np.uint8)
+    Image.fromarray(rgba, 'RGBA').save(path, 'PNG')
+
+
+def make_clip(path, seconds):
+    """Génère un clip de test ffmpeg (testsrc2 + sinus), en MPEG-4 Part 2 pour forcer un réencodage"""
+    subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                    '-f', 'lavfi', '-i', f'testsrc2=size=640x360:rate=25:duration={seconds}',
+                    '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+                    '-c:v', 'mpeg4', '-q:v', '3', '-c:a', 'pcm_s16le', path],
+                   check=True, capture_output=True)
+
+
+def build_corpus(directory, spec):
+    """Crée (ou réutilise) le corpus dans directory; retourne {pipeline: [chemins]}"""
+    os.makedirs(directory, exist_ok=True)
+    corpus = {}
+    for pipeline, params in spec.items():
+        if pipeline == 'video' and not shutil.which('ffmpeg'):
+            print('ffmpeg introuvable: pipeline vidéo ignoré', file=sys.stderr)
+            continue
+        paths = []
+        for seed, param in enumerate(params):
+            if pipeline == 'photo':
+                path, make = os.path.join(directory, f'photo_{param[0]}x{param[1]}.jpg'), make_photo
+            elif pipeline == 'png_alpha':
+                path, make = os.path.join(directory, f'alpha_{param[0]}x{param[1]}.png'), make_alpha_png
+            elif pipeline == 'gif':
+                path, make = os.path.join(directory, f'anim_{param}f.gif'), lambda p, n, _: make_gif(p, n, (480, 360))
+            else:
+                path, make = os.path.join(directory, f'clip_{param}s.avi'), lambda p, n, _: make_clip(p, n)
+            if not os.path.exists(path):
+                make(path, param, seed)
+            paths.append(path)
+        corpus[pipeline] = paths
+    return corpus
+
+
+def _suite_image(src, dst, level):
+    dst += '.webp'
+    app.smart_compress_image(src, dst, app.get_compression_settings(level))
+    return dst
+
+
+def _suite_gif(src, dst, level):
+    dst += '.gif'
+    if not app.compress_gif(src, dst, level):
+        raise RuntimeError(f'échec GIF: {src}')
+    return dst
+
+
+def _suite_video(src, dst, level):
+    dst += '.mp4'
+    if not app.compress_video(src, dst, level):
+        raise RuntimeError(f'échec vidéo: {src}')
+    return dst
+
+
+SUITE_PIPELINES = {
+    'photo': _suite_image,
+    'png_alpha': _suite_image,
+    'gif': _suite_gif,
+    'video': _suite_video,
+}
+
+
+def percentile(values, q):
+    """Percentile par rang le plus proche"""
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+def _run_suite_case(pipeline, paths, out_dir, level, repeat, queue):
+    """Passe repeat fois sur les fichiers d'un pipeline, dans un processus neuf"""
+    compress = SUITE_PIPELINES[pipeline]
+    latencies, bytes_in, bytes_out = [], 0, 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            t = time.perf_counter()
+            output = compress(path, os.path.join(out_dir, os.path.basename(path)), level)
+            latencies.append(time.perf_counter() - t)
+            bytes_in += os.path.getsize(path)
+            bytes_out += os.path.getsize(output)
+    seconds = time.perf_counter() - start
+    result = {
+        'files': len(latencies),
+        'seconds': round(seconds, 3),
+        'files_per_sec': round(len(latencies) / seconds, 3),
+        'mb_per_sec': round(bytes_in / seconds / 1e6, 3),
+        'p50_seconds': round(percentile(latencies, 50), 4),
+        'p95_seconds': round(percentile(latencies, 95), 4),
+        'peak_rss_mb': peak_rss_mb(),
+        'ratio': round(bytes_out / bytes_in, 4),
+    }
+    if resource is not None and pipeline == 'video':
+        # Pic mémoire du plus gros processus ffmpeg (ru_maxrss en Ko sous Linux)
+        result['peak_rss_children_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    queue.put(result)
+
+
+def compare_to_baseline(results, baseline, threshold, ratio_threshold):
+    """Liste les métriques dégradées de plus du seuil par rapport à la référence"""
+    regressions = []
+    for pipeline, current in results.items():
+        previous = baseline.get('results', {}).get(pipeline)
+        if not previous:
+            continue
+        for metric, direction in REGRESSION_CHECKS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            limit = ratio_threshold if metric == 'ratio' else threshold
+            if change * direction < -limit:
+                regressions.append(f'{pipeline}.{metric}: {old} -> {new} ({change:+.1%})')
+    return regressions
+
+
+def bench_suite(args):
+    """Mesure débit, latence, mémoire et taux de compression de chaque pipeline"""
+    spec = SUITE_CORPUS['quick' if args.quick else 'full']
+    corpus_dir = args.corpus or tempfile.mkdtemp(prefix='bench-corpus-')
+    try:
+        corpus = build_corpus(corpus_dir, {k: v for k, v in spec.items() if k in args.pipelines})
+        results = {}
+        with tempfile.TemporaryDirectory() as out_dir:
+            for pipeline, paths in corpus.items():
+                results[pipeline] = run_isolated(_run_suite_case, pipeline, paths, out_dir, args.level, args.repeat)
+                r = results[pipeline]
+                print(f"{pipeline:<10} {r['files_per_sec']:>8.2f} fichiers/s  {r['mb_per_sec']:>7.2f} Mo/s  "
+                      f"p50 {r['p50_seconds']:.3f}s  p95 {r['p95_seconds']:.3f}s  "
+                      f"{r['peak_rss_mb']} Mo  ratio {r['ratio']}", file=sys.stderr)
+    finally:
+        if not args.corpus:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'cpus': os.cpu_count(),
+            'corpus': 'quick' if args.quick else 'full',
+            'level': args.level,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['regressions'] = compare_to_baseline(results, baseline, args.threshold, args.ratio_threshold)
+        for line in report['regressions']:
+            print(f'RÉGRESSION {line}', file=sys.stderr)
+    return report
+
+
+# --- Démarrage à froid ---------------------------------------------------------
+# Chaque mesure tourne dans un interpréteur neuf: import de app.py, première requête
+# sur l'interface, puis requêtes suivantes, et modules lourds effectivement chargés.
+
+STARTUP_PROBE = '''
+import sys, json, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+headers = {'Accept-Encoding': 'gzip, br'}
+t = time.perf_counter()
+first = client.get('/', headers=headers)
+first_ms = (time.perf_counter() - t) * 1000
+latencies = []
+for _ in range(int(sys.argv[2])):
+    t = time.perf_counter()
+    client.get('/', headers=headers)
+    latencies.append((time.perf_counter() - t) * 1000)
+latencies.sort()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': first_ms,
+    'request_p50_ms': latencies[len(latencies) // 2],
+    'ui_bytes': len(first.data),
+    'loaded': [name for name in ('PIL.Image', 'numpy') if name in sys.modules],
+}))
+'''
+
+
+def bench_startup(args):
+    """Mesure l'import de app.py et le service de l'interface dans des processus neufs"""
+    package_dir = os.path.dirname(os.path.abspath(app.__file__))
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, '-c', STARTUP_PROBE, package_dir, str(args.requests)],
+                                 cwd=tmp, capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout))
+    result = {key: round(percentile([r[key] for r in runs], 50), 2)
+              for key in ('import_ms', 'first_request_ms', 'request_p50_ms')}
+    result.update(ui_bytes=runs[0]['ui_bytes'], loaded_after_ui=runs[0]['loaded'], repeat=args.repeat)
+    print(f"import {result['import_ms']:.0f} ms  première requête {result['first_request_ms']:.1f} ms  "
+          f"requête p50 {result['request_p50_ms']:.2f} ms  {result['ui_bytes']} octets", file=sys.stderr)
+    return result
+
+
+# --- Redimensionnement ----------------------------------------------------------
+# Chaque niveau de RESIZE_TIERS sur une photo JPEG (décodage à l'échelle DCT possible)
+# et la même en PNG (réduction par blocs seule), comparé au niveau 'quality'.
+
+def _resize_case(path, target, tier):
+    """Décode et réduit une image comme le pipeline, avec le niveau tier"""
+    with Image.open(path) as img:
+        size = app.fit_size(img.size, target)
+        img = app.decode_image(img, size, tier)
+        return app.resize_to(img.convert('RGB'), size, tier)
+
+
+def bench_resize(args):
+    """Compare les niveaux de redimensionnement: temps (décodage compris) et SSIM face à 'quality'"""
+    tiers = ['quality'] + [tier for tier in app.RESIZE_TIERS if tier != 'quality']
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        jpeg = os.path.join(tmp, 'photo.jpg')
+        png = os.path.join(tmp, 'photo.png')
+        make_photo(jpeg, (args.width, args.width * 2 // 3), 0)
+        with Image.open(jpeg) as img:
+            img.save(png)
+        for source, path in (('jpeg', jpeg), ('png', png)):
+            for target in args.targets:
+                reference = None
+                for tier in tiers:
+                    times = []
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        out = _resize_case(path, target, tier)
+                        times.append(time.perf_counter() - start)
+                    gray = np.asarray(out.convert('L'))
+                    if reference is None:
+                        reference = gray
+                    row = {
+                        'source': source,
+                        'target': target,
+                        'tier': tier,
+                        'ms': round(min(times) * 1000, 1),
+                        'ssim': round(float(app.ssim(reference, gray)), 4),
+                    }
+                    rows.append(row)
+                    print(f"{source:<5} {target:>5}px  {tier:<9} {row['ms']:>8.1f} ms  SSIM {row['ssim']:.4f}",
+                          file=sys.stderr)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks du compresseur')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gif = sub.add_parser('gif', help='GIF animés: temps, pic mémoire et taille selon le nombre de frames')
+    gif.add_argument('--frames', type=int, nargs='+', default=[50, 200, 500])
+    gif.add_argument('--size', type=int, default=480, help='largeur des GIF générés')
+    gif.add_argument('--max-dimension', type=int, default=None)
+    gif.set_defaults(func=bench_gif)
+
+    suite = sub.add_parser('suite', help='tous les pipelines sur un corpus synthétique, avec seuils de régression')
+    suite.add_argument('--quick', action='store_true', help='corpus réduit (CI)')
+    suite.add_argument('--repeat', type=int, default=3, help='passes sur le corpus par pipeline')
+    suite.add_argument('--level', default='balanced', choices=['lossless', 'balanced', 'aggressive'])
+    suite.add_argument('--pipelines', nargs='+', default=list(SUITE_PIPELINES), choices=list(SUITE_PIPELINES))
+    suite.add_argument('--corpus', help='dossier du corpus, conservé et réutilisé (temporaire par défaut)')
+    suite.add_argument('--baseline', help='rapport JSON de référence: code de sortie 1 en cas de régression')
+    suite.add_argument('--threshold', type=float, default=0.2,
+                       help='dégradation tolérée du débit, du p95 et du pic mémoire (0.2 = 20%%)')
+    suite.add_argument('--ratio-threshold', type=float, default=0.02,
+                       help='dégradation tolérée du taux de compression')
+    suite.set_defaults(func=bench_suite)
+
+    startup = sub.add_parser('startup', help='démarrage à froid: import de app.py et service de l\'interface')
+    startup.add_argument('--repeat', type=int, default=5, help='interpréteurs neufs mesurés (médiane)')
+    startup.add_argument('--requests', type=int, default=50, help='requêtes sur / après la première')
+    startup.set_defaults(func=bench_startup)
+
+    resize = sub.add_parser('resize', help='niveaux de redimensionnement: temps et SSIM par taille cible')
+    resize.add_argument('--targets', type=int, nargs='+', default=[1080, 800], help='plus grand côté visé (px)')
+    resize.add_argument('--width', type=int, default=4240, help='largeur de la photo source (3:2)')
+    resize.add_argument('--repeat', type=int, default=5, help='mesures par cas (la meilleure est gardée)')
+    resize.set_defaults(func=bench_resize)
+
+    args = parser.parse_args(argv)
+    report = args.func(args)
+    print(json.dumps(report, indent=2))
+    if isinstance(report, dict) and report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
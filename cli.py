@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Compression en masse d'une arborescence, sans passer par le serveur
+Parcourt un dossier, compresse chaque média dans un pool de processus et écrit les
+sorties dans une arborescence miroir. Un manifeste permet de reprendre un traitement
+interrompu sans refaire les fichiers déjà traités.
+
+Usage:
+    python cli.py SOURCE DESTINATION [--level balanced] [--workers 8] [--memory-mb 4096]
+
+API Python:
+    import cli
+    summary = cli.compress_tree('photos', 'photos_compressees', compression_level='aggressive')
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import app
+
+MANIFEST_NAME = '.compress-manifest.jsonl'
+MB = 1024 * 1024
+# Mémoire réservée par fichier en plus du décodage (tampons d'encodage, copies)
+TASK_OVERHEAD = 64 * MB
+# Estimation par vidéo: ffmpeg et ses segments parallèles
+VIDEO_MEMORY_MB = int(os.environ.get('VIDEO_MEMORY_MB', 1024))
+# Tentatives par fichier quand un worker meurt (OOM...): le coupable n'est pas identifiable
+MAX_ATTEMPTS = 2
+PROGRESS_INTERVAL = 1.0
+
+
+def media_kind(filename):
+    """'image', 'gif', 'video', ou None pour un fichier ignoré"""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.gif':
+        return 'gif'
+    if ext in app.VIDEO_EXTENSIONS:
+        return 'video'
+    if ext in app.IMAGE_EXTENSIONS:
+        return 'image'
+    return None
+
+
+def available_memory():
+    """Mémoire utilisable par défaut (octets): 80 % de la mémoire disponible"""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024 * 4 // 5
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2
+    except (ValueError, OSError, AttributeError):
+        return 4096 * MB
+
+
+def estimate_memory(path, kind):
+    """Mémoire que demandera la compression d'un fichier (octets), d'après son en-tête"""
+    if kind == 'video':
+        return VIDEO_MEMORY_MB * MB
+    try:
+        # Pillow réglé par app (MAX_IMAGE_PIXELS, bombe de décompression refusée)
+        with app.Image.open(path) as img:
+            pixels = img.width * img.height
+    except Exception:
+        return TASK_OVERHEAD  # illisible: le worker remontera l'erreur
+    if kind == 'gif':
+        # Frames en cours de quantification, plus la frame décodée et la précédente
+        return TASK_OVERHEAD + pixels * 4 * (app.GIF_THREADS + 2)
+    return TASK_OVERHEAD + min(pixels * app.DECODE_BYTES_PER_PIXEL, app.IMAGE_MEMORY_MB * MB)
+
+
+def walk_sources(source, destination):
+    """Liste (chemin relatif, type, nom de sortie) des médias de source, dans un ordre stable
+
+    Les noms de sortie sont rendus uniques par dossier (photo.png et photo.webp
+    donneraient toutes deux photo.webp).
+    """
+    destination = os.path.abspath(destination)
+    for root, dirs, files in os.walk(source):
+        # Ne pas retraiter la destination si elle est dans la source
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != destination)
+        taken = set()
+        for name in sorted(files):
+            kind = media_kind(name)
+            if kind is None:
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, source), kind, app.unique_filename(name, taken)
+
+
+def settings_signature(options):
+    """Identifie les réglages: un fichier traité avec d'autres réglages est refait"""
+    return json.dumps(dict(options, version=app.CACHE_VERSION), sort_keys=True)
+
+
+def load_manifest(path):
+    """Dernière entrée du manifeste pour chaque fichier source"""
+    done = {}
+    try:
+        with open(path) as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # ligne tronquée par un arrêt brutal
+                done[entry['path']] = entry
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def is_done(entry, stat, signature, retry_failed, destination):
+    """Vrai si l'entrée du manifeste couvre encore le fichier source"""
+    if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+        return False
+    if entry['settings'] != signature:
+        return False
+    if not entry['success']:
+        return not retry_failed
+    return all(os.path.exists(os.path.join(destination, path)) for path in entry['outputs'])
+
+
+class Progress:
+    """Avancement sur stderr: une ligne réécrite sur un terminal, une ligne par intervalle sinon"""
+
+    def __init__(self, total, quiet=False):
+        self.total = total
+        self.quiet = quiet
+        self.tty = sys.stderr.isatty()
+        self.start = time.perf_counter()
+        self.last = 0
+        self.counts = {'done': 0, 'failed': 0, 'skipped': 0}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def update(self, outcome, result=None):
+        self.counts[outcome] += 1
+        if result and result.get('success'):
+            self.bytes_in += result['original_size']
+            self.bytes_out += result['compressed_size']
+        now = time.perf_counter()
+        if self.quiet or now - self.last < PROGRESS_INTERVAL:
+            return
+        self.last = now
+        print(self.line(), file=sys.stderr, end='\r' if self.tty else '\n', flush=True)
+
+    def line(self):
+        finished = sum(self.counts.values())
+        elapsed = time.perf_counter() - self.start
+        processed = self.counts['done'] + self.counts['failed']
+        rate = processed / elapsed if elapsed else 0
+        eta = (self.total - finished) / rate if rate else 0
+        saved = (self.bytes_in - self.bytes_out) / MB
+        return (f"[{finished}/{self.total}] {rate:.1f} fichiers/s, {self.counts['failed']} échec(s), "
+                f"{self.counts['skipped']} déjà faits, {saved:.1f} Mo gagnés, reste ~{eta / 60:.0f} min")
+
+    def close(self):
+        if not self.quiet:
+            print(self.line(), file=sys.stderr)
+
+
+def compress_tree(source, destination, compression_level='balanced', quality=None, max_dimension=None,
+                  output_format=None, target_ssim=None, workers=None, memory_bytes=None,
+                  video_jobs=None, manifest=None, retry_failed=False, quiet=False, metadata=None,
+                  resize_tier=None):
+    """Compresse toute l'arborescence source vers destination (même structure)
+
+    workers: processus de compression (par défaut un par cœur)
+    memory_bytes: budget mémoire estimé des fichiers en cours (par défaut 80 % de la mémoire disponible)
+    video_jobs: vidéos simultanées, chacune utilisant déjà VIDEO_THREADS threads ffmpeg
+    Retourne le résumé {'done', 'failed', 'skipped', 'original_size', 'compressed_size', 'seconds'}.
+    """
+    workers = workers or os.cpu_count() or 1
+    memory_bytes = memory_bytes or available_memory()
+    video_jobs = video_jobs or max(1, (os.cpu_count() or 1) // app.VIDEO_THREADS)
+    manifest = manifest or os.path.join(destination, MANIFEST_NAME)
+    metadata = metadata or app.METADATA_POLICY
+    resize_tier = resize_tier or app.RESIZE_TIER_BY_LEVEL.get(compression_level, 'balanced')
+    options = {'level': compression_level, 'quality': quality, 'max_dimension': max_dimension,
+               'format': output_format, 'target_ssim': target_ssim, 'metadata': metadata,
+               'resize': resize_tier}
+    signature = settings_signature(options)
+
+    os.makedirs(destination, exist_ok=True)
+    done = load_manifest(manifest)
+    queues = {'video': deque(), 'other': deque()}
+    skipped = 0
+    for rel, kind, output_name in walk_sources(source, destination):
+        path = os.path.join(source, rel)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if is_done(done.get(rel), stat, signature, retry_failed, destination):
+            skipped += 1
+            continue
+        task = {'rel': rel, 'path': path, 'kind': kind, 'name': output_name, 'stat': stat, 'attempts': 0,
+                'output_dir': os.path.join(destination, os.path.dirname(rel))}
+        queues['video' if kind == 'video' else 'other'].append(task)
+
+    total = skipped + len(queues['video']) + len(queues['other'])
+    progress = Progress(total, quiet)
+    progress.counts['skipped'] = skipped
+    context = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    running = {}  # future -> (tâche, mémoire réservée)
+
+    def next_task():
+        """Prochaine tâche admissible: vidéos limitées à video_jobs, total sous le budget mémoire"""
+        used = sum(cost for _, cost in running.values())
+        videos = sum(1 for task, _ in running.values() if task['kind'] == 'video')
+        for lane in ('video', 'other'):
+            queue = queues[lane]
+            if not queue or (lane == 'video' and videos >= video_jobs):
+                continue
+            task = queue[0]
+            if 'cost' not in task:
+                task['cost'] = estimate_memory(task['path'], task['kind'])
+            # Un fichier plus gros que le budget passe seul plutôt que jamais
+            if used + task['cost'] <= memory_bytes or not running:
+                return queue.popleft()
+        return None
+
+    def record(task, result):
+        entry = {
+            'path': task['rel'],
+            'size': task['stat'].st_size,
+            'mtime_ns': task['stat'].st_mtime_ns,
+            'settings': signature,
+            'success': result['success'],
+            # Relatifs à la destination: la reprise peut se faire depuis un autre dossier
+            'outputs': [os.path.relpath(result['output_path'], destination)] if result['success'] else [],
+        }
+        if result['success']:
+            entry['compressed_size'] = result['compressed_size']
+        else:
+            entry['error'] = result['error']
+            print(f"{task['rel']}: {result['error']}", file=sys.stderr)
+        log.write(json.dumps(entry) + '\n')
+        log.flush()
+        progress.update('done' if result['success'] else 'failed', result)
+
+    try:
+        with open(manifest, 'a') as log:
+            while running or queues['video'] or queues['other']:
+                while len(running) < workers:
+                    task = next_task()
+                    if task is None:
+                        break
+                    task['attempts'] += 1
+                    future = executor.submit(app.compress_path, task['path'], task['output_dir'],
+                                             compression_level, quality, max_dimension, output_format,
+                                             target_ssim, task['name'], metadata, resize_tier)
+                    running[future] = (task, task['cost'])
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    task, _ = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        if task['attempts'] < MAX_ATTEMPTS:
+                            queues['video' if task['kind'] == 'video' else 'other'].appendleft(task)
+                            continue
+                        result = {'success': False, 'error': 'Worker arrêté brutalement (mémoire insuffisante ?)'}
+                    except Exception as e:
+                        result = {'success': False, 'error': str(e) or type(e).__name__}
+                    record(task, result)
+                if broken:
+                    # Les autres fichiers en cours sont perdus avec le pool: on les relance
+                    for future, (task, _) in running.items():
+                        queues['video' if task['kind'] == 'video' else 'other'].appendleft(task)
+                    running.clear()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        progress.close()
+
+    return {
+        'done': progress.counts['done'],
+        'failed': progress.counts['failed'],
+        'skipped': skipped,
+        'original_size': progress.bytes_in,
+        'compressed_size': progress.bytes_out,
+        'seconds': round(time.perf_counter() - progress.start, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compression en masse d\'une arborescence de médias')
+    parser.add_argument('source', help='dossier à compresser (parcouru récursivement)')
+    parser.add_argument('destination', help='dossier de sortie, même structure que la source')
+    parser.add_argument('--level', default='balanced', choices=['lossless', 'balanced', 'aggressive', 'custom', 'target'])
+    parser.add_argument('--quality', type=int, help='qualité du niveau custom (85 par défaut)')
+    parser.add_argument('--target-ssim', type=float, help='SSIM visé par le niveau target')
+    parser.add_argument('--max-dimension', type=int, help='plus grand côté des sorties (px)')
+    parser.add_argument('--format', choices=['auto'], help='auto: garder l\'encodeur le plus léger par image')
+    parser.add_argument('--metadata', choices=app.METADATA_POLICIES,
+                        help=f'strip: retirer EXIF, XMP, miniatures et convertir en sRGB; keep: conserver EXIF et ICC '
+                             f'({app.METADATA_POLICY} par défaut)')
+    parser.add_argument('--resize-tier', choices=list(app.RESIZE_TIERS),
+                        help='rééchantillonnage des images réduites: quality, balanced ou fast '
+                             '(par défaut selon --level)')
+    parser.add_argument('--workers', type=int, help='processus de compression (un par cœur par défaut)')
+    parser.add_argument('--memory-mb', type=int, help='budget mémoire des fichiers en cours (80 %% de la mémoire disponible par défaut)')
+    parser.add_argument('--video-jobs', type=int, help='vidéos compressées simultanément')
+    parser.add_argument('--manifest', help=f'manifeste de reprise (DESTINATION/{MANIFEST_NAME} par défaut)')
+    parser.add_argument('--retry-failed', action='store_true', help='retenter les fichiers en échec lors d\'une reprise')
+    parser.add_argument('--quiet', action='store_true', help='sans avancement sur stderr')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.source):
+        parser.error(f'dossier introuvable: {args.source}')
+    try:
+        summary = compress_tree(
+            args.source, args.destination, args.level, args.quality, args.max_dimension, args.format,
+            args.target_ssim, args.workers, args.memory_mb and args.memory_mb * MB, args.video_jobs,
+            args.manifest, args.retry_failed, args.quiet, args.metadata, args.resize_tier)
+    except KeyboardInterrupt:
+        print('\nInterrompu: relancer la même commande pour reprendre', file=sys.stderr)
+        sys.exit(130)
+    print(json.dumps(summary, indent=2))
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()